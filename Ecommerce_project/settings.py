@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ecommerce.profiling.ProfilingMiddleware',
+    'ecommerce.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,6 +66,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'ecommerce.navigation.category_navigation',
             ],
         },
     },
@@ -82,9 +86,26 @@ DATABASES = {
     }
 }
 
-# mongoengine connection for our custom models
-import mongoengine
-mongoengine.connect(db='ecommerce_db', host='localhost', port=27017)
+# mongoengine connection for our custom models. It is registered by
+# ecommerce.mongo when the app loads and the client is only created on the
+# first query, in each worker process. Every value can be set from the
+# environment; other keys are passed straight to pymongo's MongoClient.
+MONGODB = {
+    'db': os.environ.get('MONGODB_DB', 'ecommerce_db'),
+    'host': os.environ.get('MONGODB_HOST', 'localhost'),
+    'port': int(os.environ.get('MONGODB_PORT', 27017)),
+    'maxPoolSize': int(os.environ.get('MONGODB_MAX_POOL_SIZE', 50)),
+    'minPoolSize': int(os.environ.get('MONGODB_MIN_POOL_SIZE', 0)),
+    'connectTimeoutMS': int(os.environ.get('MONGODB_CONNECT_TIMEOUT_MS', 5000)),
+    'serverSelectionTimeoutMS': int(os.environ.get('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    'socketTimeoutMS': int(os.environ.get('MONGODB_SOCKET_TIMEOUT_MS', 30000)),
+    # How long a request waits for a free pooled connection before failing
+    'waitQueueTimeoutMS': int(os.environ.get('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+    # zstd and snappy need the zstandard / python-snappy packages, zlib is built in
+    'compressors': os.environ.get('MONGODB_COMPRESSORS', 'zlib'),
+    # primary, primaryPreferred, secondary, secondaryPreferred or nearest
+    'read_preference': os.environ.get('MONGODB_READ_PREFERENCE', 'primary'),
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -129,11 +150,87 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Resized WebP/JPEG variants generated for uploads, by media subdirectory
+IMAGE_VARIANT_WIDTHS = {
+    'products': [160, 400, 800],
+    'slides': [800, 1600],
+}
+IMAGE_WORKERS = 2
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Cache used for anonymous catalog pages. Local memory is per process, use a
+# shared backend (Redis, Memcached) when running several workers so purges
+# reach every worker.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+PAGE_CACHE_TIMEOUT = 300
+
+# Category navigation with product counts (ecommerce.navigation), rebuilt on
+# any product or category change; the timeout only bounds drift from raw writes.
+# Each worker notices changes made by the others through a version in Mongo,
+# which a background thread re-reads this often.
+CATEGORY_NAV_TIMEOUT = 3600
+CATEGORY_NAV_VERSION_POLL_SECONDS = 5
+
+# Active products below this stock level are listed on the dashboard
+LOW_STOCK_THRESHOLD = 10
+
+# Catalog listing page size (cursor pagination)
+PRODUCT_PAGE_SIZE = 24
+
+# Product search backend: MongoTextSearch uses the text index on products,
+# InMemorySearch keeps an in-process inverted index (for mongomock)
+SEARCH_BACKEND = 'ecommerce.search.MongoTextSearch'
+
+# Maximum product and category names returned by /search/suggest/
+SUGGEST_LIMIT = 8
+# A background thread in each worker checks the shared suggest version in Mongo
+# this often and replays the logged changes, and rebuilds the index once it is
+# this old even if nothing was signalled
+SUGGEST_VERSION_POLL_SECONDS = 5
+SUGGEST_INDEX_MAX_AGE = 600
+
+# Related products stored per product by build_recommendations, and shown on
+# product pages; extras stand in for related products deactivated since
+RECOMMENDATIONS_TOP_K = 12
+RELATED_PRODUCTS_LIMIT = 4
+
+# Per-request profiling (ecommerce.profiling): Server-Timing header on every
+# response, and the share of requests logged as one JSON line each
+PROFILING_SERVER_TIMING = True
+PROFILING_LOG_SAMPLE_RATE = 0.01
+
+# Prometheus metrics (ecommerce.metrics). Each worker keeps its series in an
+# mmap'd file in METRICS_DIR and /metrics sums all of them; counters of exited
+# workers are merged into metrics-archive.db. Empty the directory when the
+# server is (re)started.
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'ecommerce-metrics'))
+METRICS_SLOTS = 8192
+# Client addresses (REMOTE_ADDR) allowed to scrape /metrics, comma-separated in
+# the environment. Empty by default, which forbids every scrape. Behind a
+# reverse proxy REMOTE_ADDR is the proxy's address, so listing it would expose
+# /metrics to everyone: only set this where the scraper reaches the app server
+# directly, and block /metrics at the proxy.
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'ecommerce': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 # Login URLs
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
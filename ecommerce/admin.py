@@ -37,8 +37,8 @@ class ProductAdmin:
     search_fields = ['name', 'description']
     
     def main_image_preview(self, obj):
-        if obj.images:
-            return format_html('<img src="{}" style="max-height: 50px; max-width: 100px;" />', obj.images[0])
+        if obj.primary_image:
+            return format_html('<img src="{}" style="max-height: 50px; max-width: 100px;" />', obj.primary_image)
         return "No Image"
     main_image_preview.short_description = 'Main Image'
     
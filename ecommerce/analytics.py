@@ -0,0 +1,139 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.utils import timezone
+from pymongo import UpdateMany, UpdateOne
+
+from .models import Order, SalesRollup, RollupCheckpoint
+
+CHECKPOINT_ID = 'sales'
+
+
+def _bucket_id(day, category, status):
+    return f"{day}|{category}|{status}"
+
+
+def _sum_lines(match, *statuses):
+    """Revenue, units and order ids of the matched orders by day, category and `statuses`"""
+    key = {
+        'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$created_at'}},
+        'category': '$items.category_name',
+    }
+    key.update({field: f'${field}' for field in statuses})
+    return Order.objects.aggregate([
+        {'$match': match},
+        {'$unwind': '$items'},
+        {'$group': {
+            '_id': key,
+            'revenue': {'$sum': {'$multiply': ['$items.unit_price', '$items.quantity']}},
+            'units': {'$sum': '$items.quantity'},
+            'orders': {'$addToSet': '$_id'},
+        }},
+    ])
+
+
+def _add(bucket_id, day, category, status, revenue, units, orders):
+    return UpdateOne(
+        {'_id': bucket_id},
+        {
+            '$inc': {'revenue': revenue, 'units': units, 'orders': orders},
+            '$setOnInsert': {'day': day, 'category': category, 'status': status},
+        },
+        upsert=True
+    )
+
+
+def roll_up_sales(upto=None, rebuild=False):
+    """
+    Fold orders created or changed since the last run into daily buckets.
+
+    Orders created in (last high-water mark, upto] are grouped by (day,
+    category, status) and added to the stored buckets with $inc upserts.
+    Older orders whose updated_at falls in the same range and whose status
+    differs from the one they were counted under are subtracted from their
+    old buckets and added to the new ones. Each order records the status it
+    was counted under in rolled_up_status. Returns the number of bucket
+    updates.
+    """
+    upto = upto or timezone.now()
+    if rebuild:
+        SalesRollup.objects.delete()
+        RollupCheckpoint.objects.filter(id=CHECKPOINT_ID).delete()
+        Order._get_collection().update_many({}, {'$unset': {'rolled_up_status': ''}})
+
+    checkpoint = RollupCheckpoint.objects.filter(id=CHECKPOINT_ID).first()
+    since = checkpoint.high_water_mark if checkpoint else None
+    created_at = {'$lte': upto}
+    if since:
+        created_at['$gt'] = since
+
+    updates = []
+    counted = defaultdict(set)  # status -> ids of orders now counted under it
+    for bucket in _sum_lines({'created_at': created_at}, 'status'):
+        key = bucket['_id']
+        status = key.get('status')
+        updates.append(_add(_bucket_id(key['day'], key.get('category'), status), key['day'], key.get('category'),
+                            status, bucket['revenue'], bucket['units'], len(bucket['orders'])))
+        counted[status].update(bucket['orders'])
+
+    if since:
+        changed = Order._get_collection().find(
+            {'updated_at': {'$gt': since, '$lte': upto}, 'created_at': {'$lte': since},
+             'rolled_up_status': {'$exists': True}},
+            {'status': 1, 'rolled_up_status': 1}
+        )
+        moved = [order['_id'] for order in changed if order.get('status') != order['rolled_up_status']]
+        if moved:
+            for bucket in _sum_lines({'_id': {'$in': moved}}, 'status', 'rolled_up_status'):
+                key = bucket['_id']
+                status, old_status = key.get('status'), key.get('rolled_up_status')
+                orders = len(bucket['orders'])
+                updates.append(UpdateOne(
+                    {'_id': _bucket_id(key['day'], key.get('category'), old_status)},
+                    {'$inc': {'revenue': -bucket['revenue'], 'units': -bucket['units'], 'orders': -orders}}
+                ))
+                updates.append(_add(_bucket_id(key['day'], key.get('category'), status), key['day'],
+                                    key.get('category'), status, bucket['revenue'], bucket['units'], orders))
+                counted[status].update(bucket['orders'])
+
+    if updates:
+        collection = SalesRollup._get_collection()
+        collection.bulk_write(updates, ordered=False)
+        collection.delete_many({'orders': {'$lte': 0}})
+        Order._get_collection().bulk_write([
+            UpdateMany({'_id': {'$in': list(ids)}}, {'$set': {'rolled_up_status': status}})
+            for status, ids in counted.items()
+        ], ordered=False)
+
+    RollupCheckpoint.objects.filter(id=CHECKPOINT_ID).update_one(
+        upsert=True,
+        set__high_water_mark=upto,
+        set__updated_at=timezone.now()
+    )
+    return len(updates)
+
+
+def sales_report(days=30):
+    """Revenue by day, category and status over the last `days`, from the rollups only"""
+    since = (timezone.now() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    by_day, by_category, by_status = {}, {}, {}
+    revenue = units = 0
+    for bucket in SalesRollup._get_collection().find({'day': {'$gte': since}}):
+        for totals, key in ((by_day, bucket['day']), (by_category, bucket.get('category') or 'Uncategorized'),
+                            (by_status, bucket.get('status') or 'unknown')):
+            row = totals.setdefault(key, {'key': key, 'revenue': 0, 'units': 0})
+            row['revenue'] += bucket.get('revenue', 0)
+            row['units'] += bucket.get('units', 0)
+        revenue += bucket.get('revenue', 0)
+        units += bucket.get('units', 0)
+
+    checkpoint = RollupCheckpoint.objects.filter(id=CHECKPOINT_ID).first()
+    return {
+        'days': days,
+        'revenue': revenue,
+        'units': units,
+        'by_day': [by_day[day] for day in sorted(by_day)],
+        'by_category': sorted(by_category.values(), key=lambda row: -row['revenue']),
+        'by_status': sorted(by_status.values(), key=lambda row: -row['revenue']),
+        'rolled_up_to': checkpoint.high_water_mark if checkpoint else None,
+    }
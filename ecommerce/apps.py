@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class EcommerceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ecommerce'
+
+    def ready(self):
+        from . import cache, mongo, navigation, search, stats, suggest
+        mongo.configure()
+        cache.connect_signals()
+        stats.connect_signals()
+        search.connect_signals()
+        suggest.connect_signals()
+        navigation.connect_signals()
@@ -0,0 +1,152 @@
+import hashlib
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from mongoengine import signals
+
+from . import metrics
+from .models import Category, Product, Slide
+from .queries import reference_id
+
+PAGE_KEY_PREFIX = 'page:'
+TAG_KEY_PREFIX = 'page-tag:'
+CART_KEY_PREFIX = 'cart-version:'
+
+
+def add_cache_tags(request, *tags):
+    """
+    Record which catalog data a cached page depends on.
+
+    The current version of each tag is snapshotted here, so call this
+    before reading the data: a purge while the page renders then leaves
+    the stored entry already stale instead of marking old content fresh.
+    """
+    if not hasattr(request, 'cache_tags'):
+        request.cache_tags = {}
+    new_tags = [tag for tag in tags if tag not in request.cache_tags]
+    if new_tags:
+        request.cache_tags.update(zip(new_tags, _tag_versions(new_tags)))
+
+
+def bump_version(key):
+    """Increment a version counter kept in the cache; a missing one counts as 0"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+        return 1
+
+
+def purge_tags(*tags):
+    """Invalidate every cached page tagged with any of the given tags"""
+    for tag in tags:
+        # Pages cached before the tag existed recorded version 0
+        bump_version(TAG_KEY_PREFIX + tag)
+
+
+def cart_changed(session_key):
+    """Give a session's cart a new version, so clients refetch its summary"""
+    cache.set(CART_KEY_PREFIX + session_key, uuid.uuid4().hex, None)
+
+
+def cart_version(session_key):
+    """
+    An opaque version of a session's cart and the catalog prices in it.
+
+    Read it before the cart, so a change made meanwhile shows up as a new
+    version on the next request. A version evicted from the cache is
+    replaced by a fresh random one rather than reset, so none repeats.
+    """
+    key = CART_KEY_PREFIX + session_key
+    versions = cache.get_many([key, TAG_KEY_PREFIX + 'catalog'])
+    token = versions.get(key)
+    if token is None:
+        token = uuid.uuid4().hex
+        if not cache.add(key, token, None):
+            token = cache.get(key, token)
+    return f'{token}-{versions.get(TAG_KEY_PREFIX + "catalog", 0)}'
+
+
+def _tag_versions(tags):
+    keys = [TAG_KEY_PREFIX + tag for tag in tags]
+    versions = cache.get_many(keys)
+    return tuple(versions.get(key, 0) for key in keys)
+
+
+def _is_cacheable(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    # Flash messages are rendered into the page, never cache them
+    if request.COOKIES.get('messages'):
+        return False
+    return True
+
+
+def anonymous_page_cache(view):
+    """
+    Cache the full rendered page for anonymous visitors.
+
+    Entries are keyed on path and query string and store the version of
+    every tag the view declared with add_cache_tags(). An entry is only
+    served while all of its tags are unchanged, so saving or deleting a
+    Product, Category or Slide purges exactly the pages that showed it.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not _is_cacheable(request):
+            metrics.inc('page_cache_requests_total', {'result': 'bypass'})
+            return view(request, *args, **kwargs)
+
+        key = PAGE_KEY_PREFIX + hashlib.md5(request.get_full_path().encode()).hexdigest()
+        entry = cache.get(key)
+        if entry is not None:
+            tags, versions, content, content_type = entry
+            if _tag_versions(tags) == versions:
+                response = HttpResponse(content, content_type=content_type)
+                response['X-Page-Cache'] = 'hit'
+                metrics.inc('page_cache_requests_total', {'result': 'hit'})
+                return response
+
+        metrics.inc('page_cache_requests_total', {'result': 'miss'})
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            snapshot = getattr(request, 'cache_tags', {})
+            tags = tuple(sorted(snapshot))
+            cache.set(
+                key,
+                (tags, tuple(snapshot[tag] for tag in tags), response.content, response['Content-Type']),
+                settings.PAGE_CACHE_TIMEOUT
+            )
+            response['X-Page-Cache'] = 'miss'
+        return response
+
+    return wrapper
+
+
+def _product_changed(sender, document, **kwargs):
+    purge_tags(
+        'catalog',
+        f'product:{document.id}',
+        f'product-slug:{document.slug}',
+        f'category:{reference_id(document._data.get("category"))}',
+    )
+
+
+def _category_changed(sender, document, **kwargs):
+    purge_tags('catalog', 'categories', f'category:{document.id}')
+
+
+def _slide_changed(sender, document, **kwargs):
+    purge_tags('slides')
+
+
+def connect_signals():
+    for signal in (signals.post_save, signals.post_delete):
+        signal.connect(_product_changed, sender=Product)
+        signal.connect(_category_changed, sender=Category)
+        signal.connect(_slide_changed, sender=Slide)
@@ -0,0 +1,117 @@
+import re
+
+from django.utils.text import slugify
+from pymongo import UpdateOne
+
+from .models import Product, Slide, image_url, product_gallery
+
+# Column layout shared by import_catalog and export_catalog
+COLUMNS = ['name', 'slug', 'description', 'price', 'stock', 'category', 'is_active', 'image_urls']
+
+# image_urls are joined with this separator in CSV files
+IMAGE_URL_SEPARATOR = '|'
+
+
+def slug_base(name):
+    return slugify(name or '')[:190] or 'product'
+
+
+def _highest_suffix(collection, base):
+    """Largest N among existing '<base>-N' slugs, 1 if there are none"""
+    highest = 1
+    pattern = f'^{re.escape(base)}-(\\d+)$'
+    for doc in collection.find({'slug': {'$regex': pattern}}, {'slug': 1, '_id': 0}):
+        highest = max(highest, int(doc['slug'].rsplit('-', 1)[1]))
+    return highest
+
+
+def allocate_slugs(collection, bases):
+    """
+    Return one unused slug per base, in order.
+
+    Free bases are found with a single indexed $in query. A base that is
+    already taken (in the collection or earlier in `bases`) gets the next
+    '-N' suffix after the highest one stored.
+    """
+    taken = {doc['slug'] for doc in collection.find({'slug': {'$in': list(set(bases))}}, {'slug': 1, '_id': 0})}
+    next_suffix = {}
+    assigned = set()
+    slugs = []
+    for base in bases:
+        if base not in taken and base not in assigned:
+            slug = base
+        else:
+            if base not in next_suffix:
+                next_suffix[base] = _highest_suffix(collection, base) + 1
+            slug = f'{base}-{next_suffix[base]}'
+            while slug in assigned:
+                next_suffix[base] += 1
+                slug = f'{base}-{next_suffix[base]}'
+            next_suffix[base] += 1
+        assigned.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def unique_slug(document_class, name):
+    """Unused slug for one new document named `name`"""
+    return allocate_slugs(document_class._get_collection(), [slug_base(name)])[0]
+
+
+def product_image_fields(doc):
+    """
+    Normalized image fields of a raw product document.
+
+    Legacy `images` entries move to image_urls as URLs; gallery and
+    primary_image are then derived the way Product.save() does.
+    """
+    image_urls = list(doc.get('image_urls') or [])
+    for path in doc.get('images') or []:
+        if path and image_url(path) not in image_urls:
+            image_urls.append(image_url(path))
+    gallery = product_gallery(doc.get('image_files'), image_urls)
+    return {'image_urls': image_urls, 'gallery': gallery, 'primary_image': gallery[0] if gallery else None}
+
+
+def slide_image_fields(doc):
+    """Normalized image fields of a raw slide document, the legacy `image` becoming image_url"""
+    url = doc.get('image_url') or (image_url(doc['image']) if doc.get('image') else None)
+    path = doc.get('image_file') or url
+    return {'image_url': url, 'primary_image': image_url(path) if path else None}
+
+
+# Stored fields read, legacy field migrated away and normalizer, per document class
+IMAGE_FIELDS = {
+    Product: (('image_files', 'image_urls', 'images', 'gallery', 'primary_image'), 'images', product_image_fields),
+    Slide: (('image_file', 'image_url', 'image', 'primary_image'), 'image', slide_image_fields),
+}
+
+
+def refresh_images(document_class, query=None, batch_size=1000, dry_run=False):
+    """
+    Recompute the stored image fields of matching documents in bulk writes.
+
+    For writes that bypass save(). Legacy fields are migrated and unset on
+    the way, documents already up to date are not written. Returns the
+    number of documents changed (or that would be, with dry_run).
+    """
+    fields, legacy, normalize = IMAGE_FIELDS[document_class]
+    collection = document_class._get_collection()
+    changed = 0
+    operations = []
+    for doc in collection.find(query or {}, dict.fromkeys(fields, 1), batch_size=batch_size):
+        values = normalize(doc)
+        if not doc.get(legacy) and all(doc.get(field) == value for field, value in values.items()):
+            continue
+        update = {'$set': values}
+        if doc.get(legacy):
+            update['$unset'] = {legacy: ''}
+        operations.append(UpdateOne({'_id': doc['_id']}, update))
+        changed += 1
+        if len(operations) >= batch_size:
+            if not dry_run:
+                collection.bulk_write(operations, ordered=False)
+            operations = []
+    if operations and not dry_run:
+        collection.bulk_write(operations, ordered=False)
+    return changed
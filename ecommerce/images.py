@@ -0,0 +1,89 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+from .cache import purge_tags
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    """Process pool for image work, created lazily in each server process"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS)
+    return _executor
+
+
+def build_variants(media_root, source, widths):
+    """
+    Resize one uploaded image into WebP and JPEG variants (runs in a worker).
+
+    `source` is the stored relative path (e.g. media/products/x.jpg). Only
+    widths smaller than the original are produced. Returns a list of
+    {'source', 'width', 'format', 'path'} dicts with relative paths.
+    """
+    from PIL import Image
+
+    source = source.replace('\\', '/')
+    relative = source[len('media/'):] if source.startswith('media/') else source
+    directory, filename = os.path.split(relative)
+    stem = os.path.splitext(filename)[0]
+    variant_dir = os.path.join(media_root, directory, 'variants')
+    os.makedirs(variant_dir, exist_ok=True)
+
+    variants = []
+    with Image.open(os.path.join(media_root, relative)) as image:
+        image = image.convert('RGB')
+        for width in sorted(widths):
+            if width >= image.width:
+                break
+            height = round(image.height * width / image.width)
+            resized = image.resize((width, height), Image.LANCZOS)
+            for image_format, extension, options in (
+                ('webp', 'webp', {'quality': 80, 'method': 4}),
+                ('jpeg', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+            ):
+                name = f'{stem}_{width}.{extension}'
+                resized.save(os.path.join(variant_dir, name), image_format.upper(), **options)
+                variants.append({
+                    'source': source,
+                    'width': width,
+                    'format': image_format,
+                    'path': '/'.join(['media', directory, 'variants', name]),
+                })
+    return variants
+
+
+def schedule_variants(document, sources, kind):
+    """
+    Generate variants for newly uploaded files off the request path.
+
+    When a worker finishes, the variants are pushed onto the document's
+    image_variants list and the cached pages showing it are purged.
+    """
+    widths = settings.IMAGE_VARIANT_WIDTHS[kind]
+    for source in sources:
+        future = get_executor().submit(build_variants, str(settings.MEDIA_ROOT), source, widths)
+        future.add_done_callback(_variants_ready(type(document), document.id, source))
+
+
+def _variants_ready(document_class, document_id, source):
+    def callback(future):
+        try:
+            variants = future.result()
+        except Exception:
+            logger.exception('Could not build image variants for %s', source)
+            return
+        if not variants:
+            return
+        document_class.objects.filter(id=document_id).update_one(push_all__image_variants=variants)
+        if document_class.__name__ == 'Product':
+            purge_tags('catalog', f'product:{document_id}')
+        else:
+            purge_tags('slides')
+    return callback
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from ecommerce.cache import purge_tags
+from ecommerce.catalog import refresh_images
+from ecommerce.models import Product, Slide
+
+
+class Command(BaseCommand):
+    help = 'Store primary_image and gallery on every product and slide, migrating the legacy image fields'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Documents per bulk write')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+
+    def handle(self, *args, **options):
+        products = refresh_images(Product, batch_size=options['batch_size'], dry_run=options['dry_run'])
+        slides = refresh_images(Slide, batch_size=options['batch_size'], dry_run=options['dry_run'])
+        if not options['dry_run'] and (products or slides):
+            purge_tags('catalog', 'slides')
+
+        prefix = '[dry run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(f'{prefix}Updated {products} products and {slides} slides'))
@@ -0,0 +1,284 @@
+import math
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+from functools import wraps
+
+import mongoengine
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from pymongo import monitoring
+from ecommerce.models import Category, Product, Slide, Customer, CartItem, Order, Recommendation
+from ecommerce.navigation import get_categories
+from ecommerce.recommendations import build_recommendations
+from ecommerce.stats import reconcile
+
+# Most Mongo commands a single request to each view may issue
+QUERY_BUDGETS = {
+    'home': 3,
+    'product_list': 2,
+    'product_detail': 3,
+    'cart': 1,
+    'checkout': 1,
+    'my_orders': 2,
+    'dashboard': 4,
+}
+
+# Driver housekeeping, not issued by the views
+IGNORED_COMMANDS = {'hello', 'isMaster', 'ismaster', 'ping', 'endSessions', 'saslStart', 'saslContinue'}
+
+# mongomock emits no command events, these collection methods are counted instead
+MONGOMOCK_METHODS = [
+    'find', 'find_one', 'aggregate', 'count_documents', 'estimated_document_count', 'distinct',
+    'insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one', 'delete_one', 'delete_many',
+    'find_one_and_update', 'find_one_and_replace', 'find_one_and_delete', 'bulk_write',
+]
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Count the Mongo commands sent while a view runs, by command name"""
+
+    def __init__(self):
+        self.commands = Counter()
+
+    def started(self, event):
+        if event.command_name not in IGNORED_COMMANDS:
+            self.commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+@contextmanager
+def count_mongomock_calls(counter):
+    """Attribute mongomock collection calls to the counter, outermost call only"""
+    from mongomock.collection import Collection
+
+    depth = [0]
+    originals = {name: getattr(Collection, name) for name in MONGOMOCK_METHODS}
+
+    def counted(name, method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            if depth[0] == 0:
+                counter.commands[name] += 1
+            depth[0] += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                depth[0] -= 1
+        return wrapper
+
+    for name, method in originals.items():
+        setattr(Collection, name, counted(name, method))
+    try:
+        yield
+    finally:
+        for name, method in originals.items():
+            setattr(Collection, name, method)
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a sorted list"""
+    return samples[max(math.ceil(pct / 100 * len(samples)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway catalog and report per-view latency percentiles and Mongo command counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products', type=int, nargs='+', default=[1000],
+            help='Catalog sizes to benchmark, e.g. --products 1000 10000 100000',
+        )
+        parser.add_argument('--orders', type=int, default=1000, help='Orders to seed')
+        parser.add_argument('--carts', type=int, default=100, help='Other shoppers\' carts to seed')
+        parser.add_argument('--requests', type=int, default=50, help='Measured requests per view')
+        parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per view')
+        parser.add_argument('--mongo-db', default='ecommerce_benchmark', help='Scratch database, dropped afterwards')
+        parser.add_argument('--mongo-host', default='localhost', help='mongod to benchmark against')
+        parser.add_argument('--mongomock', action='store_true', help='Run against in-process mongomock instead')
+        parser.add_argument('--page-cache', action='store_true', help='Keep the anonymous page cache warm')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the generated data')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.counter = CommandCounter()
+        random.seed(options['seed'])
+
+        # Never touch the real databases: Mongo goes to a scratch db, SQL to a test db
+        mongoengine.disconnect()
+        if options['mongomock']:
+            try:
+                import mongomock
+            except ImportError:
+                raise CommandError('--mongomock needs the mongomock package installed')
+            mongoengine.connect(options['mongo_db'], host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+            counting = count_mongomock_calls(self.counter)
+        else:
+            mongoengine.connect(options['mongo_db'], host=options['mongo_host'], event_listeners=[self.counter])
+            counting = nullcontext()
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        over_budget = []
+        try:
+            with counting:
+                for size in options['products']:
+                    over_budget += self.benchmark(size)
+        finally:
+            mongoengine.get_connection().drop_database(options['mongo_db'])
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if over_budget:
+            raise CommandError('Over query budget: ' + ', '.join(over_budget))
+        self.stdout.write(self.style.SUCCESS('All views within their query budgets'))
+
+    def benchmark(self, size):
+        mongoengine.get_connection().drop_database(self.options['mongo_db'])
+        for document in (Category, Product, Slide, Customer, CartItem, Order, Recommendation):
+            document.ensure_indexes()
+        started = time.perf_counter()
+        slugs, anonymous, shopper = self.seed(size)
+        self.stdout.write(f'\nSeeded {size} products, {self.options["orders"]} orders and '
+                          f'{self.options["carts"] + 2} carts in {time.perf_counter() - started:.1f}s')
+
+        views = [
+            ('home', anonymous, lambda: '/'),
+            ('product_list', anonymous, lambda: '/products/'),
+            ('product_detail', anonymous, lambda: f'/product/{random.choice(slugs)}/'),
+            ('cart', anonymous, lambda: '/cart/'),
+            ('checkout', shopper, lambda: '/checkout/'),
+            ('my_orders', shopper, lambda: '/my-orders/'),
+            ('dashboard', shopper, lambda: '/dashboard/'),
+        ]
+
+        self.stdout.write(f'{"view":<16}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"queries":>9}{"budget":>8}')
+        over_budget = []
+        for name, client, url in views:
+            timings, queries = self.measure(client, url)
+            budget = QUERY_BUDGETS[name]
+            line = (f'{name:<16}{percentile(timings, 50):>9.1f}{percentile(timings, 95):>9.1f}'
+                    f'{percentile(timings, 99):>9.1f}{max(queries):>9}{budget:>8}')
+            if max(queries) > budget:
+                over_budget.append(f'{name} ({max(queries)} > {budget} at {size} products)')
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        return over_budget
+
+    def measure(self, client, url):
+        timings, queries = [], []
+        for i in range(self.options['warmup'] + self.options['requests']):
+            path = url()
+            if not self.options['page_cache']:
+                cache.clear()
+                # Only pages are measured cold, the category navigation stays warm as in production
+                get_categories()
+            self.counter.commands.clear()
+            started = time.perf_counter()
+            response = client.get(path)
+            elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code != 200:
+                raise CommandError(f'GET {path} returned {response.status_code}')
+            if i >= self.options['warmup']:
+                timings.append(elapsed)
+                queries.append(sum(self.counter.commands.values()))
+        if self.options['verbosity'] > 1:
+            self.stdout.write(f'  {path}: {dict(self.counter.commands)}')
+        return sorted(timings), queries
+
+    def seed(self, size):
+        """Insert the catalog, orders and carts with raw bulk inserts"""
+        now = timezone.now()
+        categories = [
+            {'name': f'Category {i}', 'slug': f'category-{i}', 'description': 'Benchmark category', 'created_at': now}
+            for i in range(20)
+        ]
+        category_ids = Category._get_collection().insert_many(categories).inserted_ids
+        Slide._get_collection().insert_many([
+            {
+                'title': f'Slide {i}',
+                'image_url': 'https://via.placeholder.com/1600x500',
+                'primary_image': 'https://via.placeholder.com/1600x500',
+                'order': i,
+                'is_active': True,
+            }
+            for i in range(5)
+        ])
+
+        products = Product._get_collection()
+        product_ids, slugs = [], []
+        for start in range(0, size, 10000):
+            batch = []
+            for i in range(start, min(start + 10000, size)):
+                batch.append({
+                    'name': f'Product {i}',
+                    'description': f'Benchmark product number {i}',
+                    'price': round(random.uniform(1, 500), 2),
+                    'category': random.choice(category_ids),
+                    'image_urls': ['https://via.placeholder.com/400x300'],
+                    'gallery': ['https://via.placeholder.com/400x300'],
+                    'primary_image': 'https://via.placeholder.com/400x300',
+                    'stock': random.randint(0, 100),
+                    'is_active': random.random() < 0.9,
+                    'slug': f'product-{i}',
+                    'created_at': now - timedelta(minutes=i),
+                    'updated_at': now,
+                })
+            product_ids += products.insert_many(batch).inserted_ids
+            slugs += [doc['slug'] for doc in batch if doc['is_active']]
+        slugs = slugs[:1000]
+
+        user, _ = User.objects.get_or_create(username='benchmark', defaults={'is_staff': True})
+        customer_id = Customer._get_collection().insert_one({'user_id': user.id, 'created_at': now}).inserted_id
+
+        orders = []
+        for i in range(self.options['orders']):
+            lines = [
+                {
+                    'product_id': random.choice(product_ids),
+                    'name': 'Product',
+                    'category_name': 'Category',
+                    'unit_price': 10.0,
+                    'quantity': random.randint(1, 3),
+                }
+                for _ in range(random.randint(1, 4))
+            ]
+            orders.append({
+                'order_number': f'ORD-BENCH{i:06d}',
+                # One order in ten belongs to the benchmark user
+                'customer_id': str(customer_id) if i % 10 == 0 else f'customer-{i % 500}',
+                'items': lines,
+                'total_amount': sum(line['unit_price'] * line['quantity'] for line in lines),
+                'status': random.choice(['pending', 'processing', 'shipped', 'delivered']),
+                'created_at': now - timedelta(hours=i),
+                'updated_at': now,
+            })
+        if orders:
+            Order._get_collection().insert_many(orders)
+
+        anonymous, shopper = Client(), Client()
+        shopper.force_login(user)
+        sessions = [f'benchmark-{i}' for i in range(self.options['carts'])]
+        sessions += [anonymous.session.session_key, shopper.session.session_key]
+        CartItem._get_collection().insert_many([
+            {'session_key': session_key, 'product': product_id, 'quantity': random.randint(1, 3), 'created_at': now}
+            for session_key in sessions
+            for product_id in random.sample(product_ids, min(3, len(product_ids)))
+        ])
+
+        reconcile()
+        build_recommendations()
+        return slugs, anonymous, shopper
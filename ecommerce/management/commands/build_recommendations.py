@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ecommerce import recommendations
+from ecommerce.cache import purge_tags
+
+
+class Command(BaseCommand):
+    help = 'Recompute the related products shown on product pages from order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, help='Related products stored per product (default RECOMMENDATIONS_TOP_K)')
+        parser.add_argument('--days', type=int, help='Only count orders from the last N days (default all)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Orders per cursor batch and writes per bulk write')
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days']) if options['days'] else None
+        products, co_purchased = recommendations.build_recommendations(
+            top_k=options['top_k'],
+            since=since,
+            batch_size=options['batch_size'],
+        )
+        purge_tags('recommendations')
+        engine = 'numpy' if recommendations.np is not None else 'pure Python'
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored related products for {products} products, {co_purchased} from co-purchases ({engine})'
+        ))
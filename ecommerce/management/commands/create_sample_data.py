@@ -39,7 +39,7 @@ class Command(BaseCommand):
                     'category': categories['electronics'],
                     'stock': 50,
                     'slug': 'smartphone-x1',
-                    'images': ['https://via.placeholder.com/400x300/3B82F6/FFFFFF?text=Smartphone+X1']
+                    'image_urls': ['https://via.placeholder.com/400x300/3B82F6/FFFFFF?text=Smartphone+X1']
                 },
                 {
                     'name': 'Laptop Pro',
@@ -48,7 +48,7 @@ class Command(BaseCommand):
                     'category': categories['electronics'],
                     'stock': 25,
                     'slug': 'laptop-pro',
-                    'images': ['https://via.placeholder.com/400x300/10B981/FFFFFF?text=Laptop+Pro']
+                    'image_urls': ['https://via.placeholder.com/400x300/10B981/FFFFFF?text=Laptop+Pro']
                 },
                 {
                     'name': 'Casual T-Shirt',
@@ -57,7 +57,7 @@ class Command(BaseCommand):
                     'category': categories['clothing'],
                     'stock': 100,
                     'slug': 'casual-t-shirt',
-                    'images': ['https://via.placeholder.com/400x300/F59E0B/FFFFFF?text=Casual+T-Shirt']
+                    'image_urls': ['https://via.placeholder.com/400x300/F59E0B/FFFFFF?text=Casual+T-Shirt']
                 },
                 {
                     'name': 'Denim Jeans',
@@ -66,7 +66,7 @@ class Command(BaseCommand):
                     'category': categories['clothing'],
                     'stock': 75,
                     'slug': 'denim-jeans',
-                    'images': ['https://via.placeholder.com/400x300/6366F1/FFFFFF?text=Denim+Jeans']
+                    'image_urls': ['https://via.placeholder.com/400x300/6366F1/FFFFFF?text=Denim+Jeans']
                 },
                 {
                     'name': 'Programming Python',
@@ -75,7 +75,7 @@ class Command(BaseCommand):
                     'category': categories['books'],
                     'stock': 30,
                     'slug': 'programming-python',
-                    'images': ['https://via.placeholder.com/400x300/EF4444/FFFFFF?text=Programming+Python']
+                    'image_urls': ['https://via.placeholder.com/400x300/EF4444/FFFFFF?text=Programming+Python']
                 },
                 {
                     'name': 'Garden Tools Set',
@@ -84,7 +84,7 @@ class Command(BaseCommand):
                     'category': categories['home-garden'],
                     'stock': 20,
                     'slug': 'garden-tools-set',
-                    'images': ['https://via.placeholder.com/400x300/8B5CF6/FFFFFF?text=Garden+Tools+Set']
+                    'image_urls': ['https://via.placeholder.com/400x300/8B5CF6/FFFFFF?text=Garden+Tools+Set']
                 },
             ]
             
@@ -102,21 +102,21 @@ class Command(BaseCommand):
                 {
                     'title': 'Welcome to E-Store',
                     'subtitle': 'Discover amazing products at great prices',
-                    'image': 'https://via.placeholder.com/1200x400/3B82F6/FFFFFF?text=Welcome+to+E-Store',
+                    'image_url': 'https://via.placeholder.com/1200x400/3B82F6/FFFFFF?text=Welcome+to+E-Store',
                     'order': 1,
                     'is_active': True
                 },
                 {
                     'title': 'New Arrivals',
                     'subtitle': 'Check out our latest products',
-                    'image': 'https://via.placeholder.com/1200x400/10B981/FFFFFF?text=New+Arrivals',
+                    'image_url': 'https://via.placeholder.com/1200x400/10B981/FFFFFF?text=New+Arrivals',
                     'order': 2,
                     'is_active': True
                 },
                 {
                     'title': 'Special Offers',
                     'subtitle': 'Limited time deals on selected items',
-                    'image': 'https://via.placeholder.com/1200x400/F59E0B/FFFFFF?text=Special+Offers',
+                    'image_url': 'https://via.placeholder.com/1200x400/F59E0B/FFFFFF?text=Special+Offers',
                     'order': 3,
                     'is_active': True
                 },
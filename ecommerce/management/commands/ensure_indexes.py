@@ -0,0 +1,110 @@
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from pymongo import DeleteMany, UpdateOne
+from ecommerce.models import Category, Product, Slide, Customer, CartItem, Order, SalesRollup, SuggestChange
+
+
+class Command(BaseCommand):
+    help = 'Create declared MongoDB indexes and verify view queries do not scan whole collections'
+
+    documents = [Category, Slide, Product, Customer, CartItem, Order, SalesRollup, SuggestChange]
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--skip-explain',
+            action='store_true',
+            help='Only create indexes, do not explain view query shapes',
+        )
+
+    def query_shapes(self):
+        """Query shapes issued by the views, with placeholder values"""
+        object_id = ObjectId()
+        return [
+            ('home: active slides', Slide.objects.filter(is_active=True).order_by('order')),
+            ('home/product_list: active products',
+             Product.objects.filter(is_active=True).order_by('-created_at', '-id')),
+            ('product_list: active products by category',
+             Product.objects.filter(is_active=True, category=object_id).order_by('-created_at', '-id')),
+            ('product_list: category by slug', Category.objects.filter(slug='slug')),
+            ('product_detail: product by slug', Product.objects.filter(slug='slug', is_active=True)),
+            ('product_detail: same-category fallback',
+             Product.objects.filter(category=object_id, is_active=True, id__ne=object_id).order_by('-created_at')),
+            ('search: active products by text',
+             Product.objects.filter(is_active=True).search_text('query').order_by('$text_score')),
+            ('cart: items by session', CartItem.objects.filter(session_key='session')),
+            ('add_to_cart: item by session and product',
+             CartItem.objects.filter(session_key='session', product=object_id)),
+            ('checkout: customer by user', Customer.objects.filter(user_id=0)),
+            ('my_orders: orders by customer', Order.objects.filter(customer_id='customer').order_by('-created_at')),
+            ('dashboard: recent orders', Order.objects.order_by('-created_at')),
+            ('dashboard: low stock products', Product.objects.filter(stock__lt=10, is_active=True)),
+            ('rollup_sales: orders changed since the last run',
+             Order.objects.filter(updated_at__gt=timezone.now(), updated_at__lte=timezone.now())),
+            ('analytics: rollups since a day', SalesRollup.objects.filter(day__gte='2000-01-01')),
+        ]
+
+    def merge_duplicate_cart_items(self):
+        """
+        Fold duplicate (session_key, product) cart lines into the oldest one.
+
+        Carts filled before the unique index existed can hold several lines
+        for one product, which would make creating the index fail. Returns
+        the number of lines removed.
+        """
+        pipeline = [
+            {'$sort': {'created_at': 1, '_id': 1}},
+            {'$group': {
+                '_id': {'session_key': '$session_key', 'product': '$product'},
+                'ids': {'$push': '$_id'},
+                'quantity': {'$sum': '$quantity'},
+                'lines': {'$sum': 1},
+            }},
+            {'$match': {'lines': {'$gt': 1}}},
+        ]
+        operations = []
+        removed = 0
+        for group in CartItem._get_collection().aggregate(pipeline, allowDiskUse=True):
+            keep, duplicates = group['ids'][0], group['ids'][1:]
+            operations.append(UpdateOne({'_id': keep}, {'$set': {'quantity': group['quantity']}}))
+            operations.append(DeleteMany({'_id': {'$in': duplicates}}))
+            removed += len(duplicates)
+        if operations:
+            CartItem._get_collection().bulk_write(operations, ordered=True)
+        return removed
+
+    def handle(self, *args, **options):
+        merged = self.merge_duplicate_cart_items()
+        if merged:
+            self.stdout.write(f'Merged {merged} duplicate cart lines into their oldest line')
+        for document in self.documents:
+            document.ensure_indexes()
+            self.stdout.write(f'Ensured indexes on {document._get_collection_name()}')
+
+        if options['skip_explain']:
+            self.stdout.write(self.style.SUCCESS('Indexes created'))
+            return
+
+        scans = []
+        for name, queryset in self.query_shapes():
+            plan = queryset.explain()
+            if self.has_collection_scan(plan.get('queryPlanner', {}).get('winningPlan', {})):
+                scans.append(name)
+                self.stdout.write(self.style.ERROR(f'COLLSCAN: {name}'))
+            else:
+                self.stdout.write(f'OK: {name}')
+
+        if scans:
+            raise CommandError(f'{len(scans)} view queries use a collection scan')
+        self.stdout.write(self.style.SUCCESS('Indexes created and all view queries use an index'))
+
+    def has_collection_scan(self, plan):
+        if plan.get('stage') == 'COLLSCAN':
+            return True
+        children = plan.get('inputStages', [])
+        if 'inputStage' in plan:
+            children = children + [plan['inputStage']]
+        # Mongo 7+ wraps plans from the slot based engine in queryPlan
+        if 'queryPlan' in plan:
+            children = children + [plan['queryPlan']]
+        return any(self.has_collection_scan(child) for child in children)
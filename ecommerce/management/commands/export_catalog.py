@@ -0,0 +1,63 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand
+from ecommerce.catalog import COLUMNS, IMAGE_URL_SEPARATOR
+from ecommerce.models import Category, Product
+from ecommerce.queries import reference_id
+
+
+class Command(BaseCommand):
+    help = 'Export products to a CSV or JSON Lines file readable by import_catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='File to write, or - for stdout (default)')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Products fetched per cursor batch')
+        parser.add_argument('--active-only', action='store_true', help='Skip inactive products')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        category_slugs = {doc['_id']: doc.get('slug') for doc in Category._get_collection().find({}, {'slug': 1})}
+
+        query = {'is_active': True} if options['active_only'] else {}
+        cursor = Product._get_collection().find(
+            query,
+            dict.fromkeys(COLUMNS, 1),
+            batch_size=options['batch_size'],
+        ).sort('_id', 1)
+
+        stream = self.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            if file_format == 'csv':
+                writer = csv.DictWriter(stream, fieldnames=COLUMNS)
+                writer.writeheader()
+                write = writer.writerow
+            else:
+                def write(row):
+                    stream.write(json.dumps(row) + '\n')
+
+            exported = 0
+            for doc in cursor:
+                category = doc.get('category')
+                row = {
+                    'name': doc.get('name'),
+                    'slug': doc.get('slug'),
+                    'description': doc.get('description') or '',
+                    'price': doc.get('price'),
+                    'stock': doc.get('stock', 0),
+                    'category': category_slugs.get(reference_id(category)),
+                    'is_active': doc.get('is_active', True),
+                    'image_urls': doc.get('image_urls') or [],
+                }
+                if file_format == 'csv':
+                    row['image_urls'] = IMAGE_URL_SEPARATOR.join(row['image_urls'])
+                write(row)
+                exported += 1
+        finally:
+            if stream is not self.stdout:
+                stream.close()
+
+        if path != '-':
+            self.stdout.write(self.style.SUCCESS(f'Exported {exported} products to {path}'))
@@ -0,0 +1,93 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ecommerce.models import Product, Slide, MediaFile
+
+
+class Command(BaseCommand):
+    help = 'Find and delete files under MEDIA_ROOT that no product or slide references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report orphaned files')
+        parser.add_argument(
+            '--grace-seconds',
+            type=int,
+            default=3600,
+            help='Ignore files modified more recently than this (in-flight uploads)',
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='Files deleted per batch')
+
+    def handle(self, *args, **options):
+        referenced = self.referenced_paths()
+        self.stdout.write(f'{len(referenced)} referenced media paths')
+
+        cutoff = time.time() - options['grace_seconds']
+        orphans = found = freed = 0
+        batch = []
+        for relative_path, entry in self.walk(settings.MEDIA_ROOT, 'media'):
+            found += 1
+            if relative_path in referenced:
+                continue
+            stat = entry.stat()
+            if stat.st_mtime > cutoff:
+                continue
+            orphans += 1
+            freed += stat.st_size
+            if options['dry_run']:
+                self.stdout.write(f'Orphan: {relative_path}')
+                continue
+            batch.append((relative_path, entry.path))
+            if len(batch) >= options['batch_size']:
+                self.delete_batch(batch, cutoff)
+                batch = []
+        if batch:
+            self.delete_batch(batch, cutoff)
+
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'Scanned {found} files. {action} {orphans} orphans ({freed / 1024 / 1024:.1f} MB)'
+        ))
+
+    def referenced_paths(self):
+        """Stream both collections with projections and collect every stored path"""
+        def normalize(path):
+            return path.replace('\\', '/')
+
+        referenced = set()
+        for product in Product._get_collection().find({}, {'image_files': 1, 'image_variants.path': 1}):
+            referenced.update(normalize(path) for path in product.get('image_files') or [])
+            referenced.update(normalize(variant['path']) for variant in product.get('image_variants') or [])
+        for slide in Slide._get_collection().find({}, {'image_file': 1, 'image_variants.path': 1}):
+            if slide.get('image_file'):
+                referenced.add(normalize(slide['image_file']))
+            referenced.update(normalize(variant['path']) for variant in slide.get('image_variants') or [])
+        return referenced
+
+    def walk(self, directory, relative_directory):
+        """Yield (relative path, DirEntry) for every file, one directory at a time"""
+        with os.scandir(directory) as entries:
+            subdirectories = []
+            for entry in entries:
+                relative_path = f'{relative_directory}/{entry.name}'
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append((entry.path, relative_path))
+                elif entry.is_file(follow_symlinks=False):
+                    yield relative_path, entry
+        for path, relative_path in subdirectories:
+            yield from self.walk(path, relative_path)
+
+    def delete_batch(self, batch, cutoff):
+        deleted = []
+        for relative_path, path in batch:
+            try:
+                # A deduplicated upload may have touched it since the scan
+                if os.stat(path).st_mtime > cutoff:
+                    continue
+                os.remove(path)
+                deleted.append(relative_path)
+            except OSError as e:
+                self.stdout.write(self.style.WARNING(f'Could not delete {relative_path}: {e}'))
+        MediaFile.objects.filter(path__in=deleted).delete()
+        self.stdout.write(f'Deleted {len(deleted)} files')
@@ -0,0 +1,158 @@
+import csv
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from pymongo import InsertOne, UpdateOne
+from mongoengine.errors import ValidationError
+from pymongo.errors import BulkWriteError
+from ecommerce.cache import purge_tags
+from ecommerce.catalog import IMAGE_URL_SEPARATOR, allocate_slugs, refresh_images, slug_base
+from ecommerce.models import Category, Product
+from ecommerce.stats import reconcile
+from ecommerce import navigation, suggest
+
+# Fields an import overwrites on an existing product, everything else is only set on insert
+IMPORTED_FIELDS = ('name', 'description', 'price', 'stock', 'category', 'image_urls', 'is_active', 'updated_at')
+
+
+class Command(BaseCommand):
+    help = 'Import products from a CSV or JSON Lines file with batched bulk writes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to read, or - for stdin')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Products per bulk write')
+        parser.add_argument(
+            '--create-categories',
+            action='store_true',
+            help='Create categories for unknown slugs instead of skipping the row',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        self.batch_size = options['batch_size']
+        self.create_categories = options['create_categories']
+        self.collection = Product._get_collection()
+        # Every category is resolved once, rows only do dict lookups
+        self.categories = {
+            doc['slug']: doc['_id'] for doc in Category._get_collection().find({}, {'slug': 1}) if doc.get('slug')
+        }
+        self.inserted = self.updated = self.failed = 0
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            if file_format == 'csv':
+                rows = enumerate(csv.DictReader(stream), start=2)
+            else:
+                rows = ((number, line) for number, line in enumerate(stream, start=1) if line.strip())
+            self.import_rows(rows)
+        except (OSError, csv.Error) as e:
+            raise CommandError(f'Could not read {path}: {e}')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        # Bulk writes bypass document signals, refresh what they would have maintained
+        reconcile()
+        purge_tags('catalog', 'categories')
+        suggest.invalidate()
+        navigation.invalidate()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.inserted} new and {self.updated} updated products'
+        ))
+        if self.failed:
+            self.stdout.write(self.style.WARNING(f'{self.failed} rows were skipped'))
+
+    def import_rows(self, rows):
+        batch = []
+        for number, row in rows:
+            try:
+                batch.append(self.build_document(row))
+            except (TypeError, ValueError) as e:
+                self.skip(number, e)
+                continue
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = []
+        if batch:
+            self.write_batch(batch)
+
+    def build_document(self, row):
+        """Validate one row and return it as a raw products document"""
+        if isinstance(row, str):
+            row = json.loads(row)
+            if not isinstance(row, dict):
+                raise ValueError(f'expected a JSON object, got {type(row).__name__}')
+        category_slug = (row.get('category') or '').strip()
+        category_id = self.categories.get(category_slug)
+        if category_id is None:
+            if not self.create_categories or not category_slug:
+                raise ValueError(f'unknown category "{category_slug}"')
+            category = Category.objects.create(name=category_slug.replace('-', ' ').title(), slug=category_slug)
+            category_id = self.categories[category_slug] = category.id
+
+        image_urls = row.get('image_urls') or []
+        if isinstance(image_urls, str):
+            image_urls = [url.strip() for url in image_urls.split(IMAGE_URL_SEPARATOR) if url.strip()]
+        is_active = row.get('is_active', True)
+        if isinstance(is_active, str):
+            is_active = is_active.strip().lower() in ('1', 'true', 'yes', 'on', '')
+
+        product = Product(
+            name=row.get('name'),
+            description=row.get('description') or '',
+            price=float(row.get('price')),
+            stock=int(row.get('stock') or 0),
+            category=category_id,
+            image_urls=image_urls,
+            is_active=is_active,
+            slug=(row.get('slug') or '').strip() or None,
+            updated_at=timezone.now(),
+        )
+        try:
+            product.validate()
+        except ValidationError as e:
+            raise ValueError(str(e))
+        product.refresh_images()
+        return product.to_mongo().to_dict()
+
+    def write_batch(self, batch):
+        """Insert new products and upsert rows that name their slug, in one bulk write"""
+        unnamed = [doc for doc in batch if not doc.get('slug')]
+        slugs = allocate_slugs(self.collection, [slug_base(doc['name']) for doc in unnamed])
+
+        operations = [InsertOne(dict(doc, slug=slug)) for doc, slug in zip(unnamed, slugs)]
+        for doc in batch:
+            if doc.get('slug'):
+                operations.append(UpdateOne(
+                    {'slug': doc['slug']},
+                    {
+                        '$set': {field: doc[field] for field in IMPORTED_FIELDS if field in doc},
+                        '$setOnInsert': {field: value for field, value in doc.items() if field not in IMPORTED_FIELDS + ('slug',)},
+                    },
+                    upsert=True,
+                ))
+
+        try:
+            result = self.collection.bulk_write(operations, ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for error in details['writeErrors']:
+                self.skip(f'batch item {error["index"] + 1}', error['errmsg'])
+        self.inserted += details['nInserted'] + details['nUpserted']
+        self.updated += details['nMatched']
+
+        # Updated products may also hold uploaded files, rebuild their gallery from the stored fields
+        named = [doc['slug'] for doc in batch if doc.get('slug')]
+        if named:
+            refresh_images(Product, {'slug': {'$in': named}}, self.batch_size)
+
+    def skip(self, where, reason):
+        self.failed += 1
+        if self.failed <= 20:
+            self.stderr.write(f'Skipped row {where}: {reason}')
@@ -0,0 +1,100 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+from ecommerce.models import Category, Product, CartItem, Order, OrderLine, image_url
+from ecommerce.queries import reference_id
+
+
+class Command(BaseCommand):
+    help = 'Convert legacy Order.items cart item references into embedded order lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Orders per batch')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+
+    def handle(self, *args, **options):
+        orders = Order._get_collection()
+        # Legacy orders hold CartItem ObjectIds instead of embedded documents
+        cursor = orders.find(
+            {'items': {'$type': 'objectId'}},
+            {'items': 1},
+            batch_size=options['batch_size'],
+        )
+
+        migrated = partial = 0
+        batch = []
+        for order in cursor:
+            batch.append(order)
+            if len(batch) >= options['batch_size']:
+                done, incomplete = self.migrate_batch(orders, batch, options['dry_run'])
+                migrated, partial = migrated + done, partial + incomplete
+                batch = []
+        if batch:
+            done, incomplete = self.migrate_batch(orders, batch, options['dry_run'])
+            migrated, partial = migrated + done, partial + incomplete
+
+        prefix = '[dry run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(f'{prefix}Migrated {migrated} orders'))
+        if partial:
+            self.stdout.write(self.style.WARNING(
+                f'{prefix}{partial} of them reference cart items or products that no longer exist, '
+                'their ids were kept in legacy_items'
+            ))
+
+    def migrate_batch(self, orders, batch, dry_run):
+        """
+        Resolve a batch of orders with one query per collection and rewrite their items.
+
+        Every order is rewritten, so all of them load as Order documents
+        again. Items whose cart item or product no longer exists can't be
+        snapshotted; their ids move to legacy_items instead of being
+        dropped. Returns (orders rewritten, orders with unresolved items).
+        """
+        cart_item_ids = {reference_id(item) for order in batch for item in order.get('items', [])}
+        cart_items = {
+            doc['_id']: doc
+            for doc in CartItem._get_collection().find({'_id': {'$in': list(cart_item_ids)}}, {'product': 1, 'quantity': 1})
+        }
+        product_ids = {reference_id(doc['product']) for doc in cart_items.values()}
+        products = {
+            doc['_id']: doc
+            for doc in Product._get_collection().find(
+                {'_id': {'$in': list(product_ids)}},
+                {'name': 1, 'price': 1, 'category': 1, 'image_files': 1, 'image_urls': 1, 'images': 1},
+            )
+        }
+        category_ids = {reference_id(doc.get('category')) for doc in products.values()}
+        categories = {
+            doc['_id']: doc.get('name')
+            for doc in Category._get_collection().find({'_id': {'$in': list(category_ids)}}, {'name': 1})
+        }
+
+        updates = []
+        partial = 0
+        for order in batch:
+            lines, unresolved = [], []
+            for item in order.get('items', []):
+                cart_item = cart_items.get(reference_id(item))
+                product = products.get(reference_id(cart_item['product'])) if cart_item else None
+                if product is None:
+                    unresolved.append(reference_id(item))
+                    continue
+                images = (product.get('image_files') or []) + (product.get('image_urls') or []) + (product.get('images') or [])
+                line = OrderLine(
+                    product_id=product['_id'],
+                    name=product.get('name'),
+                    category_name=categories.get(reference_id(product.get('category'))),
+                    unit_price=product.get('price', 0),
+                    quantity=cart_item.get('quantity', 1),
+                    # Same URL form as OrderLine.from_product() stores
+                    image=image_url(images[0]) if images else None
+                )
+                lines.append(line.to_mongo().to_dict())
+            changes = {'items': lines}
+            if unresolved:
+                partial += 1
+                changes['legacy_items'] = unresolved
+            updates.append(UpdateOne({'_id': order['_id']}, {'$set': changes}))
+
+        if updates and not dry_run:
+            orders.bulk_write(updates, ordered=False)
+        return len(updates), partial
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from ecommerce.stats import get_stats, reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recompute the materialized dashboard statistics from the collections'
+
+    def handle(self, *args, **options):
+        before = get_stats()
+        before = {field: getattr(before, field) for field in ('products', 'categories', 'orders', 'customers')}
+        stats = reconcile()
+        for field, previous in before.items():
+            current = getattr(stats, field)
+            drift = f' (was {previous})' if current != previous else ''
+            self.stdout.write(f'{field}: {current}{drift}')
+        self.stdout.write(f'low stock products: {len(stats.low_stock)}')
+        self.stdout.write(self.style.SUCCESS('Store statistics reconciled'))
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ecommerce.analytics import roll_up_sales
+
+
+class Command(BaseCommand):
+    help = 'Aggregate new and changed orders into daily per-category/per-status sales buckets'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lag-seconds',
+            type=int,
+            default=300,
+            help='Leave the most recent orders for the next run, so late commits are not skipped',
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Drop all buckets and aggregate every order again (run once after upgrading)',
+        )
+
+    def handle(self, *args, **options):
+        upto = timezone.now() - timedelta(seconds=options['lag_seconds'])
+        buckets = roll_up_sales(upto=upto, rebuild=options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(f'Updated {buckets} sales buckets up to {upto:%Y-%m-%d %H:%M:%S}'))
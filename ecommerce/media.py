@@ -0,0 +1,85 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+from .models import MediaFile
+
+
+def absolute_path(relative_path):
+    """Map a stored path like media/products/x.jpg onto MEDIA_ROOT"""
+    relative_path = relative_path.replace('\\', '/')
+    if relative_path.startswith('media/'):
+        relative_path = relative_path[len('media/'):]
+    return os.path.join(settings.MEDIA_ROOT, relative_path)
+
+
+def store_upload(uploaded_file, kind):
+    """
+    Store an upload under media/<kind>/ named by the SHA-256 of its content.
+
+    The file is hashed while it streams to a temporary file in the target
+    directory, then atomically renamed into place. Identical content is
+    stored once; every call takes one reference on the file, released with
+    release_file(). Returns the relative path to save on the document.
+    """
+    media_dir = os.path.join(settings.MEDIA_ROOT, kind)
+    os.makedirs(media_dir, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=media_dir, prefix='.upload-', delete=False) as destination:
+        try:
+            for chunk in uploaded_file.chunks():
+                digest.update(chunk)
+                destination.write(chunk)
+                size += len(chunk)
+        except BaseException:
+            os.unlink(destination.name)
+            raise
+
+    file_extension = os.path.splitext(uploaded_file.name)[1].lower()
+    filename = f"{digest.hexdigest()}{file_extension}"
+    file_path = os.path.join(media_dir, filename)
+    metrics.inc('uploads_total', {'kind': kind})
+    metrics.inc('upload_bytes_total', {'kind': kind}, size)
+    if os.path.exists(file_path):
+        # Same content already stored, keep the existing file. Touch it so
+        # gc_media's grace period covers this upload too, not the first one
+        os.unlink(destination.name)
+        os.utime(file_path)
+        metrics.inc('upload_deduplicated_bytes_total', {'kind': kind}, size)
+    else:
+        os.chmod(destination.name, 0o644)
+        os.replace(destination.name, file_path)
+
+    relative_path = '/'.join(['media', kind, filename])
+    MediaFile.objects.filter(path=relative_path).update_one(
+        upsert=True,
+        inc__references=1,
+        set_on_insert__size=size,
+        set_on_insert__created_at=timezone.now()
+    )
+    return relative_path
+
+
+def release_file(relative_path):
+    """
+    Drop one reference to a stored file, and its record with the last one.
+
+    The file itself is left for gc_media: unlinking it here would race
+    with a concurrent upload of the same content, which finds the file
+    still in place, keeps it and takes a new reference just before it
+    disappears. gc_media only removes files that nothing references once
+    they are older than its grace period.
+    """
+    if not relative_path:
+        return
+    relative_path = relative_path.replace('\\', '/')
+    record = MediaFile.objects.filter(path=relative_path).modify(new=True, dec__references=1)
+    if record is not None and record.references <= 0:
+        # Only delete the record if nobody took a new reference meanwhile
+        MediaFile.objects.filter(path=relative_path, references__lte=0).delete()
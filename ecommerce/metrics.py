@@ -0,0 +1,306 @@
+import fcntl
+import glob
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Each series is one fixed-size slot: a float64 value followed by its name
+SLOT_SIZE = 128
+KEY_SIZE = SLOT_SIZE - 8
+VALUE = struct.Struct('d')
+FILE_PATTERN = re.compile(r'metrics-(\d+)\.db$')
+# Counters of exited workers, merged into one file so theirs can be removed
+ARCHIVE_FILE = 'metrics-archive.db'
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MONGO_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+METRIC_TYPES = {
+    'http_request_duration_seconds': 'histogram',
+    'http_responses_total': 'counter',
+    'mongo_commands_total': 'counter',
+    'mongo_command_failures_total': 'counter',
+    'mongo_command_duration_seconds': 'histogram',
+    'mongo_pool_connections': 'gauge',
+    'mongo_pool_checked_out': 'gauge',
+    'mongo_pool_max_size': 'gauge',
+    'mongo_pool_checkout_failures_total': 'counter',
+    'uploads_total': 'counter',
+    'upload_bytes_total': 'counter',
+    'upload_deduplicated_bytes_total': 'counter',
+    'page_cache_requests_total': 'counter',
+}
+
+
+class MetricsFile:
+    """
+    This process's series, stored in an mmap'd file under METRICS_DIR.
+
+    Every worker writes only its own file; the lock serialises its own
+    threads, which would otherwise lose updates to the read-modify-write
+    of a slot. The file is (re)opened lazily per pid, which keeps forked
+    workers from sharing one mapping.
+    """
+
+    def __init__(self):
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def _open(self):
+        from django.conf import settings
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = os.path.join(settings.METRICS_DIR, f'metrics-{os.getpid()}.db')
+        size = settings.METRICS_SLOTS * SLOT_SIZE
+        with open(path, 'wb') as f:
+            f.truncate(size)
+        with open(path, 'r+b') as f:
+            self.map = mmap.mmap(f.fileno(), size)
+        self.capacity = settings.METRICS_SLOTS
+        self.offsets = {}
+        self.pid = os.getpid()
+
+    def offset(self, key):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self._open()
+        offset = self.offsets.get(key)
+        if offset is None:
+            with self.lock:
+                offset = self.offsets.get(key)
+                if offset is None:
+                    encoded = key.encode()
+                    if len(encoded) > KEY_SIZE or len(self.offsets) >= self.capacity:
+                        logger.warning('Metrics file has no room for %s', key)
+                        return None
+                    offset = len(self.offsets) * SLOT_SIZE
+                    self.map[offset + 8:offset + 8 + len(encoded)] = encoded
+                    self.offsets[key] = offset
+        return offset
+
+    def add(self, key, amount):
+        offset = self.offset(key)
+        if offset is not None:
+            with self.lock:
+                VALUE.pack_into(self.map, offset, VALUE.unpack_from(self.map, offset)[0] + amount)
+
+
+_file = MetricsFile()
+_keys = {}
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    pairs = ','.join(
+        '{}="{}"'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for label, value in sorted(labels.items())
+    )
+    return f'{name}{{{pairs}}}'
+
+
+def inc(name, labels=None, amount=1):
+    """Add to a counter (or a gauge, with a negative amount)"""
+    _file.add(_series(name, labels), amount)
+
+
+def observe(name, labels, value, buckets):
+    """Record one observation in a cumulative histogram"""
+    cache_key = (name, tuple(sorted(labels.items())))
+    keys = _keys.get(cache_key)
+    if keys is None:
+        keys = _keys[cache_key] = (
+            [(bound, _series(f'{name}_bucket', dict(labels, le=repr(float(bound))))) for bound in buckets]
+            + [(float('inf'), _series(f'{name}_bucket', dict(labels, le='+Inf')))],
+            _series(f'{name}_sum', labels),
+            _series(f'{name}_count', labels),
+        )
+    bucket_keys, sum_key, count_key = keys
+    # Empty buckets are written too, so every bucket exists and in ascending order
+    for bound, key in bucket_keys:
+        _file.add(key, 1 if value <= bound else 0)
+    _file.add(sum_key, value)
+    _file.add(count_key, 1)
+
+
+def _family(key):
+    name = key.split('{', 1)[0]
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRIC_TYPES:
+            return name[:-len(suffix)]
+    return name
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read(path):
+    """The series of one metrics file as {key: value}, in slot order"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    series = {}
+    for offset in range(0, len(data), SLOT_SIZE):
+        key = data[offset + 8:offset + SLOT_SIZE].rstrip(b'\0')
+        if not key:
+            break
+        series[key.decode(errors='replace')] = VALUE.unpack_from(data, offset)[0]
+    return series
+
+
+def _write(path, series):
+    data = bytearray(len(series) * SLOT_SIZE)
+    for offset, (key, value) in zip(range(0, len(data), SLOT_SIZE), series.items()):
+        encoded = key.encode()
+        VALUE.pack_into(data, offset, value)
+        data[offset + 8:offset + 8 + len(encoded)] = encoded
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def archive(directory, pids):
+    """
+    Merge the counters of exited workers into the archive file and delete
+    their files. Gauges are dropped: they described the exited process.
+    """
+    with open(os.path.join(directory, 'metrics-archive.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        # Another scrape may have archived some of them while we waited
+        paths = [path for path in (os.path.join(directory, f'metrics-{pid}.db') for pid in pids) if os.path.exists(path)]
+        if not paths:
+            return
+        archive_path = os.path.join(directory, ARCHIVE_FILE)
+        merged = _read(archive_path) if os.path.exists(archive_path) else {}
+        for path in paths:
+            for key, value in _read(path).items():
+                if METRIC_TYPES.get(_family(key)) != 'gauge':
+                    merged[key] = merged.get(key, 0) + value
+        _write(archive_path, merged)
+        for path in paths:
+            os.remove(path)
+
+
+def collect(directory):
+    """Sum every worker's series and the archive; files of exited workers are archived first"""
+    dead = []
+    for path in glob.glob(os.path.join(directory, 'metrics-*.db')):
+        match = FILE_PATTERN.search(path)
+        if match and not _is_alive(int(match.group(1))):
+            dead.append(int(match.group(1)))
+    if dead:
+        archive(directory, dead)
+    totals = {}
+    for path in sorted(glob.glob(os.path.join(directory, 'metrics-*.db'))):
+        try:
+            series = _read(path)
+        except FileNotFoundError:  # A worker exited and was archived meanwhile
+            continue
+        for key, value in series.items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def render(totals):
+    """Format summed series in the Prometheus text exposition format"""
+    families = {}
+    for key, value in totals.items():
+        families.setdefault(_family(key), []).append((key, value))
+    lines = []
+    for family, samples in families.items():
+        lines.append(f'# TYPE {family} {METRIC_TYPES.get(family, "untyped")}')
+        lines.extend(f'{key} {value:g}' if value != int(value) else f'{key} {int(value)}' for key, value in samples)
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """Latency histogram and response counter per URL name"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else 'unmatched'
+        observe('http_request_duration_seconds', {'view': view}, time.perf_counter() - started, HTTP_BUCKETS)
+        inc('http_responses_total', {'view': view, 'status': response.status_code})
+        return response
+
+
+class MongoMetricsListener(monitoring.CommandListener):
+    """Count and time Mongo commands per collection"""
+
+    def __init__(self):
+        self.in_flight = {}
+
+    def started(self, event):
+        collection = event.command.get('collection' if event.command_name == 'getMore' else event.command_name)
+        self.in_flight[event.request_id] = collection if isinstance(collection, str) else 'none'
+
+    def succeeded(self, event):
+        collection = self.in_flight.pop(event.request_id, 'none')
+        labels = {'collection': collection, 'command': event.command_name}
+        inc('mongo_commands_total', labels)
+        observe('mongo_command_duration_seconds', labels, event.duration_micros / 1e6, MONGO_BUCKETS)
+
+    def failed(self, event):
+        collection = self.in_flight.pop(event.request_id, 'none')
+        inc('mongo_command_failures_total', {'collection': collection, 'command': event.command_name})
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Track open and checked out connections of each Mongo server pool"""
+
+    def __init__(self):
+        self.max_sizes = {}
+
+    def connection_created(self, event):
+        inc('mongo_pool_connections', {'address': '%s:%s' % event.address})
+
+    def connection_closed(self, event):
+        inc('mongo_pool_connections', {'address': '%s:%s' % event.address}, -1)
+
+    def connection_checked_out(self, event):
+        inc('mongo_pool_checked_out', {'address': '%s:%s' % event.address})
+
+    def connection_checked_in(self, event):
+        inc('mongo_pool_checked_out', {'address': '%s:%s' % event.address}, -1)
+
+    def connection_check_out_failed(self, event):
+        inc('mongo_pool_checkout_failures_total', {'address': '%s:%s' % event.address, 'reason': event.reason})
+
+    def pool_created(self, event):
+        size = self.max_sizes[event.address] = event.options.get('maxPoolSize', 100)
+        inc('mongo_pool_max_size', {'address': '%s:%s' % event.address}, size)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        inc('mongo_pool_max_size', {'address': '%s:%s' % event.address}, -self.max_sizes.pop(event.address, 0))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
@@ -1,8 +1,18 @@
-from mongoengine import Document, StringField, FloatField, IntField, ListField, ReferenceField, DateTimeField, BooleanField, ImageField
+from mongoengine import Document, EmbeddedDocument, StringField, FloatField, IntField, ListField, DictField, ReferenceField, EmbeddedDocumentField, ObjectIdField, DateTimeField, BooleanField, ImageField
 from django.contrib.auth.models import User
 from django.utils import timezone
 import uuid
-import os
+
+def image_url(path):
+    """URL for a stored image: uploaded files are served from /media/, URLs are kept as is"""
+    path = path.replace('\\', '/')
+    if path.startswith(('http://', 'https://', '//', '/', 'data:')):
+        return path
+    return '/' + path
+
+def product_gallery(image_files, image_urls, images=()):
+    """Image URLs of a product in display order (file uploads take precedence)"""
+    return [image_url(path) for path in [*(image_files or []), *(image_urls or []), *(images or [])] if path]
 
 class Category(Document):
     name = StringField(max_length=100, required=True)
@@ -12,7 +22,8 @@ class Category(Document):
     
     meta = {
         'collection': 'categories',
-        'ordering': ['name']
+        'ordering': ['name'],
+        'index_background': True
     }
     
     def __str__(self):
@@ -23,41 +34,54 @@ class Slide(Document):
     subtitle = StringField(max_length=200)
     image_url = StringField()  # Store image URL
     image_file = StringField()  # Store uploaded image file path
+    image_variants = ListField(DictField())  # Resized WebP/JPEG copies of image_file
     # Legacy field support
     image = StringField()  # Keep for backward compatibility
+    primary_image = StringField()  # URL of the image to show, maintained by save()
     order = IntField(default=0)
     is_active = BooleanField(default=True)
     created_at = DateTimeField(default=timezone.now)
     
     meta = {
         'collection': 'slides',
-        'ordering': ['order']
+        'ordering': ['order'],
+        'indexes': [
+            ('is_active', 'order'),
+        ],
+        'index_background': True
     }
     
     def __str__(self):
         return self.title or f"Slide {self.order}"
     
-    @property
-    def image_display(self):
-        """Return the image to display (file upload takes precedence)"""
-        if self.image_file:
-            # Normalize path separators for URLs
-            return self.image_file.replace('\\', '/')
-        if self.image_url:
-            return self.image_url
-        # Fallback to legacy field
-        if hasattr(self, 'image') and self.image:
-            return self.image
-        return None
+    def save(self, *args, **kwargs):
+        self.refresh_images()
+        return super().save(*args, **kwargs)
+    
+    def refresh_images(self):
+        """Derive primary_image from the stored image fields (file upload takes precedence)"""
+        path = self.image_file or self.image_url or self.image
+        self.primary_image = image_url(path) if path else None
     
     def delete(self, *args, **kwargs):
-        # Delete uploaded file when slide is deleted
-        if self.image_file and os.path.exists(self.image_file):
-            try:
-                os.remove(self.image_file)
-            except:
-                pass
+        from .media import release_file
         super().delete(*args, **kwargs)
+        # Uploaded files are shared by content, gc_media removes them once unreferenced
+        release_file(self.image_file)
+
+class MediaFile(Document):
+    """Reference count for a content-addressed file under media/"""
+    path = StringField(primary_key=True)  # e.g. media/products/<sha256>.jpg
+    references = IntField(default=0)
+    size = IntField()
+    created_at = DateTimeField(default=timezone.now)
+    
+    meta = {
+        'collection': 'media_files'
+    }
+    
+    def __str__(self):
+        return f"{self.path} ({self.references} refs)"
 
 class Product(Document):
     name = StringField(max_length=200, required=True)
@@ -66,9 +90,14 @@ class Product(Document):
     category = ReferenceField(Category, required=True)
     image_urls = ListField(StringField())  # Store image URLs
     image_files = ListField(StringField())  # Store uploaded image file paths
+    image_variants = ListField(DictField())  # Resized WebP/JPEG copies of image_files
     # Legacy field support
     images = ListField(StringField())  # Keep for backward compatibility
+    # Derived from the fields above by save(), so templates and list queries read one field
+    primary_image = StringField()  # URL of the first image
+    gallery = ListField(StringField())  # URLs of every image in display order
     stock = IntField(default=0)
+    reservations = ListField(StringField())  # Order numbers holding stock mid-checkout
     is_active = BooleanField(default=True)
     slug = StringField(max_length=200, unique=True)
     created_at = DateTimeField(default=timezone.now)
@@ -76,35 +105,38 @@ class Product(Document):
     
     meta = {
         'collection': 'products',
-        'ordering': ['-created_at']
+        'ordering': ['-created_at'],
+        'indexes': [
+            ('is_active', '-created_at', '-id'),
+            ('is_active', 'category', '-created_at', '-id'),
+            ('is_active', 'stock'),
+            {
+                'fields': ['$name', '$description'],
+                'default_language': 'english',
+                'weights': {'name': 10, 'description': 2},
+            },
+        ],
+        'index_background': True
     }
     
     def __str__(self):
         return self.name
     
-    @property
-    def images_display(self):
-        """Return all images to display (file uploads take precedence)"""
-        all_images = []
-        if self.image_files:
-            all_images.extend(self.image_files)
-        if self.image_urls:
-            all_images.extend(self.image_urls)
-        # Fallback to legacy field
-        if hasattr(self, 'images') and self.images:
-            all_images.extend(self.images)
-        return all_images
+    def save(self, *args, **kwargs):
+        self.refresh_images()
+        return super().save(*args, **kwargs)
+    
+    def refresh_images(self):
+        """Derive gallery and primary_image from the stored image fields"""
+        self.gallery = product_gallery(self.image_files, self.image_urls, self.images)
+        self.primary_image = self.gallery[0] if self.gallery else None
     
     def delete(self, *args, **kwargs):
-        # Delete uploaded files when product is deleted
-        if self.image_files:
-            for image_path in self.image_files:
-                if os.path.exists(image_path):
-                    try:
-                        os.remove(image_path)
-                    except:
-                        pass
+        from .media import release_file
         super().delete(*args, **kwargs)
+        # Uploaded files are shared by content, gc_media removes them once unreferenced
+        for image_path in self.image_files or []:
+            release_file(image_path)
 
 class Customer(Document):
     user_id = IntField(required=True)  # Store Django User ID
@@ -113,7 +145,11 @@ class Customer(Document):
     created_at = DateTimeField(default=timezone.now)
     
     meta = {
-        'collection': 'customers'
+        'collection': 'customers',
+        'indexes': [
+            'user_id',
+        ],
+        'index_background': True
     }
     
     def __str__(self):
@@ -130,26 +166,158 @@ class CartItem(Document):
     created_at = DateTimeField(default=timezone.now)
     
     meta = {
-        'collection': 'cart_items'
+        'collection': 'cart_items',
+        'indexes': [
+            {'fields': ['session_key', 'product'], 'unique': True},
+        ],
+        'index_background': True,
+        # Carts may hold duplicate lines from before the unique index, which
+        # ensure_indexes merges first; creating it on first use would fail
+        'auto_create_index': False
     }
     
     def __str__(self):
         return f"{self.product.name} x {self.quantity}"
 
+class OrderLine(EmbeddedDocument):
+    """Immutable snapshot of a cart line taken at checkout"""
+    product_id = ObjectIdField()
+    name = StringField(max_length=200, required=True)
+    category_name = StringField(max_length=100)
+    unit_price = FloatField(required=True)
+    quantity = IntField(default=1, min_value=1)
+    image = StringField()  # Primary image path or URL at checkout time
+    
+    @property
+    def subtotal(self):
+        return self.unit_price * self.quantity
+    
+    @classmethod
+    def from_product(cls, product, quantity):
+        """Snapshot a product (or cart line product) for an order"""
+        return cls(
+            product_id=product.id,
+            name=product.name,
+            category_name=product.category.name if product.category else None,
+            unit_price=product.price,
+            quantity=quantity,
+            image=product.primary_image
+        )
+
 class Order(Document):
     order_number = StringField(unique=True, default=lambda: f"ORD-{uuid.uuid4().hex[:8].upper()}")
-    customer_id = IntField(required=True)  # Store Customer ID
-    items = ListField(ReferenceField(CartItem))
+    customer_id = StringField(required=True)  # Store Customer ID
+    items = ListField(EmbeddedDocumentField(OrderLine))
+    legacy_items = ListField(ObjectIdField())  # Cart item ids migrate_order_lines could not resolve
     total_amount = FloatField(required=True)
     status = StringField(choices=['pending', 'processing', 'shipped', 'delivered', 'cancelled'], default='pending')
     shipping_address = StringField(max_length=500)
     created_at = DateTimeField(default=timezone.now)
     updated_at = DateTimeField(default=timezone.now)
+    rolled_up_status = StringField()  # Status roll_up_sales last counted this order under
     
     meta = {
         'collection': 'orders',
-        'ordering': ['-created_at']
+        'ordering': ['-created_at'],
+        'indexes': [
+            ('customer_id', '-created_at'),
+            '-created_at',
+            'updated_at',
+        ],
+        'index_background': True
     }
     
     def __str__(self):
         return f"Order {self.order_number}"
+    
+    def save(self, *args, **kwargs):
+        # roll_up_sales finds status changes by updated_at, so every edit must bump it
+        if self.pk:
+            self.updated_at = timezone.now()
+        return super().save(*args, **kwargs)
+
+class StoreStats(Document):
+    """Materialized dashboard counters, kept current by ecommerce.stats"""
+    id = StringField(primary_key=True, default='global')
+    products = IntField(default=0)
+    categories = IntField(default=0)
+    orders = IntField(default=0)
+    customers = IntField(default=0)
+    low_stock = ListField(ObjectIdField())  # Active products below LOW_STOCK_THRESHOLD
+    reconciled_at = DateTimeField()
+    
+    meta = {
+        'collection': 'store_stats'
+    }
+    
+    def __str__(self):
+        return f"Store stats ({self.products} products, {self.orders} orders)"
+
+class SalesRollup(Document):
+    """Pre-aggregated sales for one day, category and order status"""
+    id = StringField(primary_key=True)  # "<day>|<category>|<status>"
+    day = StringField(required=True)  # YYYY-MM-DD (UTC)
+    category = StringField()
+    status = StringField()
+    revenue = FloatField(default=0)
+    units = IntField(default=0)
+    orders = IntField(default=0)  # Orders with at least one line in this bucket
+    
+    meta = {
+        'collection': 'sales_rollups',
+        'ordering': ['day'],
+        'indexes': [
+            'day',
+        ],
+        'index_background': True
+    }
+    
+    def __str__(self):
+        return f"{self.day} {self.category} {self.status}: {self.revenue}"
+
+class RollupCheckpoint(Document):
+    """High-water mark of an incremental rollup job"""
+    id = StringField(primary_key=True)
+    high_water_mark = DateTimeField()
+    updated_at = DateTimeField(default=timezone.now)
+    
+    meta = {
+        'collection': 'rollup_checkpoints'
+    }
+
+class Recommendation(Document):
+    """Related products of one product, precomputed by build_recommendations"""
+    id = ObjectIdField(primary_key=True)  # The product's id
+    related = ListField(ObjectIdField())  # Best match first
+    scores = ListField(FloatField())  # Orders bought together, 0 for same-category fill-ins
+    updated_at = DateTimeField(default=timezone.now)
+    
+    meta = {
+        'collection': 'recommendations'
+    }
+
+class SharedVersion(Document):
+    """Version counter of per-process derived data, bumped by whichever worker changes it"""
+    id = StringField(primary_key=True)
+    version = IntField(default=0)
+    
+    meta = {
+        'collection': 'shared_versions'
+    }
+
+class SuggestChange(Document):
+    """One suggest index change, keyed by the shared version it produced"""
+    id = IntField(primary_key=True)
+    kind = StringField()  # 'product' or 'category'; None makes every worker rebuild
+    document_id = ObjectIdField()
+    name = StringField()  # None removes the document from the index
+    slug = StringField()
+    created_at = DateTimeField(default=timezone.now)
+    
+    meta = {
+        'collection': 'suggest_changes',
+        'indexes': [
+            # Workers further behind than this rebuild instead of replaying the log
+            {'fields': ['created_at'], 'expireAfterSeconds': 3600},
+        ]
+    }
@@ -0,0 +1,63 @@
+import os
+
+import mongoengine
+from mongoengine import connection
+from pymongo import ReadPreference
+
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
+}
+
+_fork_hook_installed = False
+
+
+def configure():
+    """
+    Register the default Mongo connection from settings.MONGODB.
+
+    Registering does no I/O: mongoengine creates the MongoClient on the
+    first query, so management commands that never query (check,
+    collectstatic) don't connect at all, and under a preforking server
+    every worker builds its own client after the fork.
+    """
+    from django.conf import settings
+    from .metrics import MongoMetricsListener, PoolMetricsListener
+    from .profiling import MongoCommandListener
+
+    global _fork_hook_installed
+    options = dict(settings.MONGODB)
+    db = options.pop('db')
+    read_preference = READ_PREFERENCES[options.pop('read_preference', 'primary')]
+    mongoengine.register_connection(
+        connection.DEFAULT_CONNECTION_NAME,
+        db=db,
+        read_preference=read_preference,
+        event_listeners=[MongoCommandListener(), MongoMetricsListener(), PoolMetricsListener()],
+        **options
+    )
+    if not _fork_hook_installed:
+        os.register_at_fork(after_in_child=_forget_client)
+        _fork_hook_installed = True
+
+
+def _forget_client():
+    """
+    Drop a client inherited from the parent process.
+
+    It is not closed: its sockets are shared with the parent, and closing
+    them from here would end the parent's sessions. The child creates its
+    own client from the registered settings on its next query.
+    """
+    from mongoengine import Document
+    from mongoengine.base.common import _get_documents_by_db
+
+    alias = connection.DEFAULT_CONNECTION_NAME
+    connection._connections.pop(alias, None)
+    if connection._dbs.pop(alias, None) is not None:
+        for doc_cls in _get_documents_by_db(alias, alias):
+            if issubclass(doc_cls, Document):
+                doc_cls._disconnect()
@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+from mongoengine import signals
+from pymongo import ReturnDocument
+
+from .models import Category, Product, SharedVersion
+
+logger = logging.getLogger(__name__)
+
+# SharedVersion document bumped on every product or category change, so
+# workers with their own cache notice changes made elsewhere
+VERSION_ID = 'category-nav'
+CACHE_KEY = 'category-nav'
+
+_version = 0
+_poller_pid = None
+_lock = threading.Lock()
+
+
+def build_categories():
+    """Categories ordered by name, each with its number of active products"""
+    counts = {
+        row['_id']: row['count']
+        for row in Product._get_collection().aggregate([
+            {'$match': {'is_active': True}},
+            {'$group': {'_id': '$category', 'count': {'$sum': 1}}},
+        ])
+    }
+    return [
+        {'id': doc['_id'], 'name': doc.get('name'), 'slug': doc.get('slug'), 'product_count': counts.get(doc['_id'], 0)}
+        for doc in Category._get_collection().find({}, {'name': 1, 'slug': 1}).sort('name', 1)
+    ]
+
+
+def _read_version():
+    doc = SharedVersion._get_collection().find_one({'_id': VERSION_ID}, {'version': 1})
+    return (doc or {}).get('version', 0)
+
+
+def _poll():
+    global _version
+    while True:
+        time.sleep(settings.CATEGORY_NAV_VERSION_POLL_SECONDS)
+        try:
+            _version = _read_version()
+        except Exception:
+            logger.exception('Could not read the category navigation version')
+
+
+def current_version():
+    """
+    The shared navigation version as last seen by this worker.
+
+    The first call reads it and starts a background thread that re-reads
+    it every CATEGORY_NAV_VERSION_POLL_SECONDS, so requests do not query
+    Mongo for it.
+    """
+    global _version, _poller_pid
+    if _poller_pid != os.getpid():
+        with _lock:
+            # Threads do not survive a fork, so each worker process starts its own
+            if _poller_pid != os.getpid():
+                _version = _read_version()
+                _poller_pid = os.getpid()
+                threading.Thread(target=_poll, daemon=True).start()
+    return _version
+
+
+def get_categories():
+    """
+    Return the category navigation from the cache.
+
+    The entry records the version it was built at; saving or deleting a
+    product or category bumps the shared version, so the next read in any
+    worker rebuilds it with one aggregation and one category query.
+    """
+    version = current_version()
+    entry = cache.get(CACHE_KEY)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    categories = build_categories()
+    cache.set(CACHE_KEY, (version, categories), settings.CATEGORY_NAV_TIMEOUT)
+    return categories
+
+
+def get_category(slug):
+    """
+    The navigation entry for a category slug, or None.
+
+    Slugs missing from the cached list are looked up directly: the cache
+    may be local to this process, and another worker or an import may
+    have created the category since the list was built.
+    """
+    category = next((category for category in get_categories() if category['slug'] == slug), None)
+    if category is None:
+        doc = Category._get_collection().find_one({'slug': slug}, {'name': 1, 'slug': 1})
+        if doc is not None:
+            category = {'id': doc['_id'], 'name': doc.get('name'), 'slug': doc.get('slug'), 'product_count': None}
+    return category
+
+
+def invalidate():
+    """Rebuild the navigation on its next read in every worker, e.g. after a bulk import"""
+    global _version
+    doc = SharedVersion._get_collection().find_one_and_update(
+        {'_id': VERSION_ID},
+        {'$inc': {'version': 1}},
+        projection={'version': 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    _version = doc['version']
+
+
+def category_navigation(request):
+    """Context processor exposing the cached navigation as nav_categories, read on first use"""
+    return {'nav_categories': SimpleLazyObject(get_categories)}
+
+
+def _changed(sender, document, **kwargs):
+    invalidate()
+
+
+def connect_signals():
+    for signal in (signals.post_save, signals.post_delete):
+        signal.connect(_changed, sender=Product)
+        signal.connect(_changed, sender=Category)
@@ -0,0 +1,131 @@
+from mongoengine import signals
+from pymongo import UpdateOne
+
+from .cache import cart_changed, purge_tags
+from .models import Product, CartItem, Order, OrderLine
+from .stats import refresh_low_stock
+
+
+class OutOfStock(Exception):
+    """Raised when checkout cannot reserve stock for every cart line"""
+
+    def __init__(self, product_names):
+        self.product_names = product_names
+        super().__init__(f"Not enough stock for: {', '.join(product_names)}")
+
+
+def place_order(customer_id, session_key, cart_items, total, shipping_address):
+    """
+    Reserve stock for every cart line and create the order.
+
+    Stock is decremented with one bulk_write of conditional $inc updates
+    (filtered on stock >= quantity), so concurrent checkouts can never
+    oversell. When the deployment supports it the whole checkout runs in a
+    multi-document transaction; otherwise each reserved product is tagged
+    with the order number so a partial reservation can be rolled back.
+    Only the given cart lines are removed from the cart, a line added
+    meanwhile (e.g. from another tab) stays for a later order. Raises
+    OutOfStock if any line could not be reserved.
+    """
+    quantities = {}
+    names = {}
+    for item in cart_items:
+        quantities[item.product.id] = quantities.get(item.product.id, 0) + item.quantity
+        names[item.product.id] = item.product.name
+
+    order = Order(
+        customer_id=customer_id,
+        items=[OrderLine.from_product(item.product, item.quantity) for item in cart_items],
+        total_amount=total,
+        shipping_address=shipping_address
+    )
+    order.validate()
+    cart_item_ids = [item.id for item in cart_items]
+
+    products = Product._get_collection()
+    if _supports_transactions(products.database.client):
+        _place_in_transaction(order, cart_item_ids, quantities, names)
+    else:
+        _place_with_rollback(order, cart_item_ids, quantities, names)
+
+    cart_changed(session_key)
+    # The bulk stock update bypasses save() signals, refresh what depends on stock
+    purge_tags(*[f'product:{product_id}' for product_id in quantities])
+    refresh_low_stock(quantities)
+    return order
+
+
+def _supports_transactions(client):
+    description = getattr(client, 'topology_description', None)
+    return description is not None and description.topology_type_name in ('ReplicaSetWithPrimary', 'Sharded')
+
+
+def _place_in_transaction(order, cart_item_ids, quantities, names):
+    products = Product._get_collection()
+    with products.database.client.start_session() as session:
+        with session.start_transaction():
+            result = products.bulk_write([
+                UpdateOne(
+                    {'_id': product_id, 'is_active': True, 'stock': {'$gte': quantity}},
+                    {'$inc': {'stock': -quantity}}
+                )
+                for product_id, quantity in quantities.items()
+            ], ordered=False, session=session)
+            if result.matched_count < len(quantities):
+                session.abort_transaction()
+                raise OutOfStock(_short_products(quantities, names))
+            inserted = Order._get_collection().insert_one(order.to_mongo(), session=session)
+            CartItem._get_collection().delete_many({'_id': {'$in': cart_item_ids}}, session=session)
+    order.id = inserted.inserted_id
+    signals.post_save.send(Order, document=order, created=True)
+
+
+def _short_products(quantities, names):
+    """Names of products that cannot currently cover the requested quantity"""
+    stock = {
+        doc['_id']: doc.get('stock', 0)
+        for doc in Product._get_collection().find(
+            {'_id': {'$in': list(quantities)}, 'is_active': True}, {'stock': 1}
+        )
+    }
+    return [names[product_id] for product_id, quantity in quantities.items() if stock.get(product_id, 0) < quantity]
+
+
+def _place_with_rollback(order, cart_item_ids, quantities, names):
+    products = Product._get_collection()
+    token = order.order_number
+    result = products.bulk_write([
+        UpdateOne(
+            {'_id': product_id, 'is_active': True, 'stock': {'$gte': quantity}},
+            {'$inc': {'stock': -quantity}, '$push': {'reservations': token}}
+        )
+        for product_id, quantity in quantities.items()
+    ], ordered=False)
+
+    if result.matched_count < len(quantities):
+        reserved = {
+            doc['_id'] for doc in products.find({'_id': {'$in': list(quantities)}, 'reservations': token}, {'_id': 1})
+        }
+        _release(reserved, quantities, token)
+        raise OutOfStock([names[product_id] for product_id in quantities if product_id not in reserved])
+
+    try:
+        order.save(force_insert=True)
+    except Exception:
+        _release(quantities, quantities, token)
+        raise
+    CartItem._get_collection().delete_many({'_id': {'$in': cart_item_ids}})
+    products.update_many({'_id': {'$in': list(quantities)}}, {'$pull': {'reservations': token}})
+
+
+def _release(product_ids, quantities, token):
+    """Give back stock reserved under token for the given products"""
+    if not product_ids:
+        return
+    Product._get_collection().bulk_write([
+        UpdateOne(
+            {'_id': product_id, 'reservations': token},
+            {'$inc': {'stock': quantities[product_id]}, '$pull': {'reservations': token}}
+        )
+        for product_id in product_ids
+    ], ordered=False)
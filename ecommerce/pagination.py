@@ -0,0 +1,91 @@
+import base64
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+
+
+def encode_cursor(document):
+    """Encode the (created_at, id) position of a document as an opaque cursor"""
+    raw = f"{document.created_at.isoformat()}|{document.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor back into (created_at, ObjectId), or None if invalid"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, object_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), ObjectId(object_id)
+    except (ValueError, TypeError, InvalidId):
+        return None
+
+
+class CursorPage:
+    """A single page of results with cursors to its neighbours"""
+
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def paginate_by_cursor(queryset, after=None, before=None, page_size=None, load=list):
+    """
+    Keyset pagination over (created_at, id), newest first.
+
+    Matches Product.meta['ordering'] with id as a tie-breaker, so every page
+    is a bounded index range scan instead of a skip over earlier pages.
+    `load` turns the page's queryset into its objects, e.g. projected rows;
+    they must keep created_at and id for the cursors.
+    """
+    page_size = page_size or settings.PRODUCT_PAGE_SIZE
+    position = decode_cursor(before or after) if (before or after) else None
+
+    if position and before:
+        created_at, object_id = position
+        queryset = queryset.filter(__raw__={'$or': [
+            {'created_at': {'$gt': created_at}},
+            {'created_at': created_at, '_id': {'$gt': object_id}},
+        ]}).order_by('created_at', 'id')
+        results = load(queryset.limit(page_size + 1))
+        has_more = len(results) > page_size
+        results = results[:page_size][::-1]
+        has_previous, has_next = has_more, True
+    else:
+        if position:
+            created_at, object_id = position
+            queryset = queryset.filter(__raw__={'$or': [
+                {'created_at': {'$lt': created_at}},
+                {'created_at': created_at, '_id': {'$lt': object_id}},
+            ]})
+        queryset = queryset.order_by('-created_at', '-id')
+        results = load(queryset.limit(page_size + 1))
+        has_next = len(results) > page_size
+        results = results[:page_size]
+        has_previous = position is not None
+
+    return CursorPage(
+        results,
+        next_cursor=encode_cursor(results[-1]) if results and has_next else None,
+        prev_cursor=encode_cursor(results[0]) if results and has_previous else None,
+    )
@@ -0,0 +1,158 @@
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from bson import json_util
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Profile of the request being served by this thread/task, None outside requests
+_current = ContextVar('request_profile', default=None)
+
+# Command fields that differ between otherwise identical queries
+VOLATILE_FIELDS = {'lsid', '$db', '$clusterTime', '$readPreference', 'txnNumber', 'autocommit', 'startTransaction'}
+
+
+class RequestProfile:
+    """Mongo commands and timings collected for one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.template_ms = 0.0
+        self.template_depth = 0
+        self.mongo_ms = 0.0
+        self.commands = []  # (name, collection, shape) per command sent
+        self.collections = Counter()
+        self.pending = set()  # request ids of commands still in flight
+
+    def duplicates(self):
+        """Identical queries sent more than once, most repeated first"""
+        shapes = Counter((name, collection, shape) for name, collection, shape in self.commands if shape)
+        return [(key, count) for key, count in shapes.most_common() if count > 1]
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Attribute every Mongo command to the request that sent it.
+
+    pymongo calls listeners on the thread that issues the command, so the
+    profile is looked up from a context variable set by the middleware.
+    """
+
+    def started(self, event):
+        profile = _current.get()
+        if profile is None:
+            return
+        command = event.command
+        collection = command.get(event.command_name)
+        if event.command_name == 'getMore':
+            collection, shape = command.get('collection'), None
+        else:
+            shape = json_util.dumps({key: value for key, value in command.items() if key not in VOLATILE_FIELDS})
+        if not isinstance(collection, str):
+            collection = None
+        profile.pending.add(event.request_id)
+        profile.commands.append((event.command_name, collection, shape))
+        profile.collections[collection or event.command_name] += 1
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    def _finished(self, event):
+        profile = _current.get()
+        if profile is not None and event.request_id in profile.pending:
+            profile.pending.discard(event.request_id)
+            profile.mongo_ms += event.duration_micros / 1000
+
+
+def _instrumented_render(render):
+    def _render(self, context):
+        profile = _current.get()
+        if profile is None:
+            return render(self, context)
+        # Included and extended templates render inside their parent, time the outermost only
+        profile.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            profile.template_depth -= 1
+            if not profile.template_depth:
+                profile.template_ms += (time.perf_counter() - started) * 1000
+    _render.profiled = True
+    return _render
+
+
+def instrument_templates():
+    """Time template rendering the way django.test instruments Template._render"""
+    from django.template.base import Template
+    if not getattr(Template._render, 'profiled', False):
+        Template._render = _instrumented_render(Template._render)
+
+
+class ProfilingMiddleware:
+    """
+    Report where a request's time went in a Server-Timing header.
+
+    Splits the time into Mongo commands, template rendering and the rest
+    of the view. A PROFILING_LOG_SAMPLE_RATE share of requests is also
+    logged as one JSON line, and in DEBUG repeated identical queries are
+    logged as a warning.
+    """
+
+    def __init__(self, get_response):
+        from django.conf import settings
+        self.get_response = get_response
+        self.server_timing = settings.PROFILING_SERVER_TIMING
+        self.sample_rate = settings.PROFILING_LOG_SAMPLE_RATE
+        self.debug = settings.DEBUG
+        instrument_templates()
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total_ms = (time.perf_counter() - profile.started) * 1000
+        view_ms = 0.0
+        if profile.view_started is not None:
+            view_ms = (time.perf_counter() - profile.view_started) * 1000 - profile.template_ms - profile.mongo_ms
+
+        if self.server_timing:
+            response['Server-Timing'] = ', '.join([
+                f'mongo;dur={profile.mongo_ms:.1f};desc="{len(profile.commands)} commands"',
+                f'view;dur={max(view_ms, 0):.1f}',
+                f'template;dur={profile.template_ms:.1f}',
+                f'total;dur={total_ms:.1f}',
+            ])
+
+        if self.sample_rate and random.random() < self.sample_rate:
+            logger.info(json.dumps({
+                'path': request.path,
+                'view': getattr(request.resolver_match, 'view_name', None),
+                'status': response.status_code,
+                'total_ms': round(total_ms, 1),
+                'view_ms': round(max(view_ms, 0), 1),
+                'template_ms': round(profile.template_ms, 1),
+                'mongo_ms': round(profile.mongo_ms, 1),
+                'mongo_commands': len(profile.commands),
+                'collections': dict(profile.collections),
+            }))
+
+        if self.debug:
+            for (name, collection, shape), count in profile.duplicates():
+                logger.warning('%s sent the same %s on %s %d times: %s', request.path, name, collection, count, shape)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _current.get().view_started = time.perf_counter()
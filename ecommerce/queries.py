@@ -0,0 +1,233 @@
+from bson import DBRef
+
+from .models import CartItem, Category
+
+# Fields each list template reads, the rest of the document stays on the server
+PRODUCT_CARD_FIELDS = (
+    'name', 'slug', 'description', 'price', 'category', 'created_at', 'primary_image', 'image_variants',
+)
+PRODUCT_ADMIN_FIELDS = (
+    'name', 'slug', 'description', 'price', 'stock', 'is_active', 'category', 'created_at', 'primary_image',
+)
+LOW_STOCK_FIELDS = ('name', 'price', 'stock', 'category')
+RELATED_PRODUCT_FIELDS = ('name', 'slug', 'price', 'category', 'primary_image')
+
+
+def select_related(documents, *fields):
+    """
+    Batch-dereference ReferenceFields on a list of documents.
+
+    Like Django's select_related: each field costs one `$in` query for the
+    whole list instead of one query per document. Nested references use
+    double-underscore paths, e.g. select_related(cart_items, 'product__category').
+    """
+    documents = list(documents)
+    for path in fields:
+        _resolve_path(documents, path.split('__'))
+    return documents
+
+
+def _resolve_path(documents, parts):
+    name, rest = parts[0], parts[1:]
+    targets = _dereference(documents, name)
+    if rest:
+        _resolve_path(targets, rest)
+
+
+def _dereference(documents, name):
+    """Load every still-lazy reference for `name` in one query and attach it"""
+    pending = {}
+    for document in documents:
+        value = document._data.get(name)
+        if isinstance(value, DBRef):
+            field = document._fields[name]
+            pending.setdefault(field.document_type, set()).add(value.id)
+
+    loaded = {}
+    for document_type, ids in pending.items():
+        loaded.update(document_type.objects.in_bulk(list(ids)))
+
+    targets = []
+    for document in documents:
+        value = document._data.get(name)
+        if isinstance(value, DBRef):
+            value = loaded.get(value.id, value)
+            document._data[name] = value
+        if value is not None and not isinstance(value, DBRef):
+            targets.append(value)
+    return targets
+
+
+class CategoryRow:
+    """A category's name and slug, as shown next to product rows"""
+
+    __slots__ = ('id', 'name', 'slug')
+
+    def __init__(self, data):
+        self.id = data.get('_id')
+        self.name = data.get('name', '')
+        self.slug = data.get('slug', '')
+
+
+class ProductRow:
+    """
+    A product built from a projected raw document, for list templates.
+
+    Fields left out of the projection are None (empty for image_variants).
+    """
+
+    __slots__ = (
+        'id', 'name', 'slug', 'description', 'price', 'stock', 'is_active', 'created_at',
+        'primary_image', 'image_variants', 'category',
+    )
+
+    def __init__(self, data, category=None):
+        self.id = data['_id']
+        self.name = data.get('name')
+        self.slug = data.get('slug')
+        self.description = data.get('description')
+        self.price = data.get('price')
+        self.stock = data.get('stock')
+        self.is_active = data.get('is_active')
+        self.created_at = data.get('created_at')
+        self.primary_image = data.get('primary_image')
+        self.image_variants = data.get('image_variants') or []
+        self.category = category
+
+    def __str__(self):
+        return self.name or ''
+
+
+def reference_id(value):
+    """The id a reference field holds, whether a DBRef, a loaded document or a bare id"""
+    return getattr(value, 'id', value)
+
+
+def product_rows(queryset, fields):
+    """
+    Load a product queryset as ProductRow objects, reading only `fields`.
+
+    Documents come back raw through as_pymongo(), skipping mongoengine's
+    per-field conversion. Categories cost one `$in` query for the whole
+    list. Apply the projection before slicing: mongoengine opens the
+    cursor on [a:b], so use .limit() on the queryset instead.
+    """
+    documents = list(queryset.only(*fields).as_pymongo())
+
+    categories = {}
+    if 'category' in fields:
+        ids = {reference_id(doc['category']) for doc in documents if doc.get('category')}
+        if ids:
+            cursor = Category._get_collection().find({'_id': {'$in': list(ids)}}, {'name': 1, 'slug': 1})
+            categories = {doc['_id']: CategoryRow(doc) for doc in cursor}
+    return [ProductRow(doc, categories.get(reference_id(doc.get('category')))) for doc in documents]
+
+
+class CartProduct:
+    """Product fields embedded in a cart line by the cart aggregation"""
+
+    def __init__(self, data):
+        self.id = data.get('_id')
+        self.name = data.get('name')
+        self.slug = data.get('slug')
+        self.price = data.get('price', 0)
+        self.stock = data.get('stock', 0)
+        self.primary_image = data.get('primary_image')
+        self.image_variants = data.get('image_variants') or []
+        self.category = CartCategory(data.get('category') or {})
+
+
+class CartCategory:
+    def __init__(self, data):
+        self.name = data.get('name', '')
+        self.slug = data.get('slug', '')
+
+
+class CartLine:
+    """A cart item joined with its product, as consumed by cart templates"""
+
+    def __init__(self, data):
+        self.id = data['_id']
+        self.quantity = data['quantity']
+        self.subtotal = data['subtotal']
+        self.product = CartProduct(data['product'])
+
+
+def cart_lines(session_key):
+    """
+    Return (lines, total) for a session's cart in a single aggregation.
+
+    Products and their categories are joined server-side with $lookup, and
+    line subtotals and the cart total are computed by Mongo.
+    """
+    pipeline = [
+        {'$match': {'session_key': session_key}},
+        {'$sort': {'created_at': 1}},
+        {'$lookup': {
+            'from': 'products',
+            'localField': 'product',
+            'foreignField': '_id',
+            'as': 'product',
+        }},
+        {'$unwind': '$product'},
+        {'$lookup': {
+            'from': 'categories',
+            'localField': 'product.category',
+            'foreignField': '_id',
+            'as': 'category',
+        }},
+        {'$project': {
+            'quantity': 1,
+            'subtotal': {'$multiply': ['$product.price', '$quantity']},
+            'product': {
+                '_id': '$product._id',
+                'name': '$product.name',
+                'slug': '$product.slug',
+                'price': '$product.price',
+                'stock': '$product.stock',
+                'primary_image': '$product.primary_image',
+                'image_variants': '$product.image_variants',
+                'category': {'$arrayElemAt': ['$category', 0]},
+            },
+        }},
+        {'$group': {
+            '_id': None,
+            'lines': {'$push': '$$ROOT'},
+            'total': {'$sum': '$subtotal'},
+        }},
+    ]
+    result = next(CartItem.objects.aggregate(pipeline), None)
+    if result is None:
+        return [], 0
+    return [CartLine(line) for line in result['lines']], result['total']
+
+
+def summarize_cart(session_key):
+    """
+    Return (item_count, total) for a session's cart, projecting only prices.
+
+    The $lookup's own pipeline trims each joined product to its price on
+    the server (MongoDB 5.0+ for localField together with pipeline).
+    """
+    pipeline = [
+        {'$match': {'session_key': session_key}},
+        {'$project': {'product': 1, 'quantity': 1}},
+        {'$lookup': {
+            'from': 'products',
+            'localField': 'product',
+            'foreignField': '_id',
+            'pipeline': [{'$project': {'_id': 0, 'price': 1}}],
+            'as': 'product',
+        }},
+        {'$unwind': '$product'},
+        {'$project': {'quantity': 1, 'price': '$product.price'}},
+        {'$group': {
+            '_id': None,
+            'item_count': {'$sum': 1},
+            'total': {'$sum': {'$multiply': ['$price', '$quantity']}},
+        }},
+    ]
+    result = next(CartItem.objects.aggregate(pipeline), None)
+    if result is None:
+        return 0, 0
+    return result['item_count'], result['total']
@@ -0,0 +1,183 @@
+import heapq
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ReplaceOne
+
+from .models import Order, Product, Recommendation
+from .queries import CategoryRow, ProductRow, product_rows, reference_id, RELATED_PRODUCT_FIELDS
+
+try:
+    import numpy as np
+except ImportError:  # Counted in pure Python instead, fine for small order histories
+    np = None
+
+# Larger baskets are skipped: they add size² pairs and say little about affinity
+MAX_BASKET_SIZE = 50
+
+
+def load_baskets(since=None, batch_size=1000):
+    """Yield the distinct product ids of each order that was not cancelled"""
+    query = {'status': {'$ne': 'cancelled'}}
+    if since is not None:
+        query['created_at'] = {'$gte': since}
+    cursor = Order._get_collection().find(query, {'items.product_id': 1, '_id': 0}, batch_size=batch_size)
+    for order in cursor:
+        # Orders not yet migrated to embedded lines hold bare cart item ids
+        basket = {item.get('product_id') for item in order.get('items') or [] if isinstance(item, dict)}
+        basket.discard(None)
+        if 1 < len(basket) <= MAX_BASKET_SIZE:
+            yield basket
+
+
+def top_pairs_numpy(baskets, size, top_k):
+    """
+    Most co-purchased items of every item, as {item: [(other, orders)]}.
+
+    Each basket is expanded into all of its ordered (item, other) pairs
+    with array arithmetic, np.unique counts the distinct pairs (a sparse
+    co-occurrence matrix in coordinate form), and one lexsort ranks the
+    neighbours of every item at once.
+    """
+    lengths = np.fromiter((len(basket) for basket in baskets), dtype=np.int64, count=len(baskets))
+    items = np.fromiter((item for basket in baskets for item in basket), dtype=np.int64, count=int(lengths.sum()))
+    # Every entry is paired with each entry of its own basket, itself included
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    widths = np.repeat(lengths, lengths)
+    left = np.repeat(items, widths)
+    offsets = np.arange(int(widths.sum())) - np.repeat(np.cumsum(widths) - widths, widths)
+    right = items[np.repeat(starts, widths) + offsets]
+    distinct = left != right
+
+    pairs, counts = np.unique(left[distinct] * size + right[distinct], return_counts=True)
+    left, right = pairs // size, pairs % size
+    order = np.lexsort((right, -counts, left))
+    left, right, counts = left[order], right[order], counts[order]
+    rank = np.arange(len(left)) - np.searchsorted(left, left)
+    best = rank < top_k
+
+    neighbours = defaultdict(list)
+    for item, other, count in zip(left[best].tolist(), right[best].tolist(), counts[best].tolist()):
+        neighbours[item].append((other, count))
+    return neighbours
+
+
+def top_pairs_python(baskets, size, top_k):
+    """Same result as top_pairs_numpy, with one Counter per item"""
+    counts = defaultdict(Counter)
+    for basket in baskets:
+        for item in basket:
+            row = counts[item]
+            for other in basket:
+                if other != item:
+                    row[other] += 1
+    return {
+        item: heapq.nsmallest(top_k, row.items(), key=lambda pair: (-pair[1], pair[0]))
+        for item, row in counts.items()
+    }
+
+
+def build_recommendations(top_k=None, since=None, batch_size=1000):
+    """
+    Recompute the stored related products of every active product.
+
+    Neighbours are the products most often bought in the same order (ties
+    go to the newer product); products with fewer than top_k of them are
+    topped up with the newest active products of their category. Entries
+    of products that are no longer active are removed. Returns (products,
+    products with at least one co-purchase neighbour).
+    """
+    top_k = top_k or settings.RECOMMENDATIONS_TOP_K
+    started = timezone.now()
+    products = list(
+        Product._get_collection().find({'is_active': True}, {'category': 1}).sort([('created_at', -1), ('_id', -1)])
+    )
+    ids = [doc['_id'] for doc in products]
+    index = {product_id: position for position, product_id in enumerate(ids)}
+
+    baskets = []
+    for basket in load_baskets(since, batch_size):
+        basket = [index[product_id] for product_id in basket if product_id in index]
+        if len(basket) > 1:
+            baskets.append(basket)
+    top_pairs = top_pairs_numpy if np is not None else top_pairs_python
+    neighbours = top_pairs(baskets, len(ids), top_k) if baskets else {}
+
+    by_category = defaultdict(list)  # Newest first, like ids
+    for position, doc in enumerate(products):
+        by_category[reference_id(doc.get('category'))].append(position)
+
+    collection = Recommendation._get_collection()
+    operations = []
+    co_purchased = 0
+    for position, product_id in enumerate(ids):
+        ranked = neighbours.get(position, [])
+        co_purchased += bool(ranked)
+        related = [other for other, _ in ranked]
+        scores = [float(count) for _, count in ranked]
+        if len(related) < top_k:
+            chosen = set(related) | {position}
+            for other in by_category[reference_id(products[position].get('category'))]:
+                if len(related) >= top_k:
+                    break
+                if other not in chosen:
+                    related.append(other)
+                    scores.append(0.0)
+        operations.append(ReplaceOne(
+            {'_id': product_id},
+            {'related': [ids[other] for other in related], 'scores': scores, 'updated_at': started},
+            upsert=True,
+        ))
+        if len(operations) >= batch_size:
+            collection.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    collection.delete_many({'updated_at': {'$lt': started}})
+    return len(ids), co_purchased
+
+
+def related_products(product, limit=None):
+    """
+    Related products for a product page, best first.
+
+    One aggregation: a point read of the product's stored recommendations,
+    with the related products and their categories joined by $lookup (one
+    result per related product). Products added since the last build fall
+    back to the newest active products of their category.
+    """
+    limit = limit or settings.RELATED_PRODUCTS_LIMIT
+    pipeline = [
+        {'$match': {'_id': product.id}},
+        {'$lookup': {
+            'from': 'products',
+            'localField': 'related',
+            'foreignField': '_id',
+            'as': 'product',
+        }},
+        # Keep the recommendation when none of its products exist any more
+        {'$unwind': {'path': '$product', 'preserveNullAndEmptyArrays': True}},
+        {'$lookup': {
+            'from': 'categories',
+            'localField': 'product.category',
+            'foreignField': '_id',
+            'as': 'category',
+        }},
+        {'$project': {
+            'related': 1,
+            **{f'product.{field}': 1 for field in ('_id', 'is_active') + RELATED_PRODUCT_FIELDS},
+            'category': {'$arrayElemAt': ['$category', 0]},
+        }},
+    ]
+    results = list(Recommendation.objects.aggregate(pipeline))
+    if not results:
+        queryset = Product.objects.filter(category=product.category.id, is_active=True, id__ne=product.id)
+        return product_rows(queryset.limit(limit), RELATED_PRODUCT_FIELDS)
+
+    found = {
+        result['product']['_id']: ProductRow(result['product'], CategoryRow(result.get('category') or {}))
+        for result in results
+        if result.get('product', {}).get('is_active')
+    }
+    return [found[product_id] for product_id in results[0]['related'] if product_id in found][:limit]
@@ -0,0 +1,102 @@
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from mongoengine import signals
+
+from .models import Product
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Relative weight of a match in each field, mirrored by the text index on Product
+FIELD_WEIGHTS = {'name': 10, 'description': 2}
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+class MongoTextSearch:
+    """Search active products with the weighted text index on Product"""
+
+    def search(self, query, offset, limit):
+        return list(
+            Product.objects.filter(is_active=True)
+            .search_text(query)
+            .order_by('$text_score')
+            .skip(offset)
+            .limit(limit)
+        )
+
+
+class InMemorySearch:
+    """
+    In-process inverted index over active products.
+
+    Used where Mongo text indexes are unavailable (e.g. mongomock). Built
+    from one projected scan on first use and rebuilt lazily after any
+    product is saved or deleted.
+    """
+
+    def __init__(self):
+        self._index = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._index = None
+
+    def _build(self):
+        index = defaultdict(lambda: defaultdict(int))
+        projection = dict.fromkeys(FIELD_WEIGHTS, 1)
+        for doc in Product._get_collection().find({'is_active': True}, projection):
+            for field, weight in FIELD_WEIGHTS.items():
+                for term in tokenize(doc.get(field)):
+                    index[term][doc['_id']] += weight
+        return index
+
+    def search(self, query, offset, limit):
+        index = self._index
+        if index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._build()
+                index = self._index
+
+        scores = defaultdict(int)
+        for term in set(tokenize(query)):
+            for product_id, score in index.get(term, {}).items():
+                scores[product_id] += score
+        ranked = sorted(scores, key=lambda product_id: (-scores[product_id], str(product_id)))
+        ranked = ranked[offset:offset + limit]
+
+        products = Product.objects.in_bulk(ranked)
+        return [products[product_id] for product_id in ranked if product_id in products]
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.SEARCH_BACKEND)()
+    return _backend
+
+
+def search_products(query, page=1, page_size=None):
+    """Return (products, has_next) for one page of ranked results"""
+    page_size = page_size or settings.PRODUCT_PAGE_SIZE
+    results = get_backend().search(query, (page - 1) * page_size, page_size + 1)
+    return results[:page_size], len(results) > page_size
+
+
+def _product_changed(sender, document, **kwargs):
+    if isinstance(_backend, InMemorySearch):
+        _backend.invalidate()
+
+
+def connect_signals():
+    signals.post_save.connect(_product_changed, sender=Product)
+    signals.post_delete.connect(_product_changed, sender=Product)
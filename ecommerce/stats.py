@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.utils import timezone
+from mongoengine import signals
+
+from .models import Category, Product, Customer, Order, StoreStats
+
+STATS_ID = 'global'
+
+COUNTERS = {
+    Product: 'products',
+    Category: 'categories',
+    Order: 'orders',
+    Customer: 'customers',
+}
+
+
+def _update(update):
+    # No upsert: until reconcile() creates the document, counters are unknown
+    StoreStats._get_collection().update_one({'_id': STATS_ID}, update)
+
+
+def _is_low_stock(stock, is_active):
+    return is_active and (stock or 0) < settings.LOW_STOCK_THRESHOLD
+
+
+def _document_saved(sender, document, created=False, **kwargs):
+    update = {}
+    if created:
+        update['$inc'] = {COUNTERS[sender]: 1}
+    if sender is Product:
+        if _is_low_stock(document.stock, document.is_active):
+            update['$addToSet'] = {'low_stock': document.id}
+        else:
+            update['$pull'] = {'low_stock': document.id}
+    if update:
+        _update(update)
+
+
+def _document_deleted(sender, document, **kwargs):
+    update = {'$inc': {COUNTERS[sender]: -1}}
+    if sender is Product:
+        update['$pull'] = {'low_stock': document.id}
+    _update(update)
+
+
+def refresh_low_stock(product_ids):
+    """Re-check low-stock membership after stock changed outside of save()"""
+    product_ids = list(product_ids)
+    low = [
+        doc['_id'] for doc in Product._get_collection().find(
+            {'_id': {'$in': product_ids}, 'is_active': True, 'stock': {'$lt': settings.LOW_STOCK_THRESHOLD}},
+            {'_id': 1}
+        )
+    ]
+    if low:
+        _update({'$addToSet': {'low_stock': {'$each': low}}})
+    low = set(low)
+    restocked = [product_id for product_id in product_ids if product_id not in low]
+    if restocked:
+        _update({'$pull': {'low_stock': {'$in': restocked}}})
+
+
+def reconcile():
+    """Recompute every counter from the collections and store the result"""
+    stats = {field: document._get_collection().count_documents({}) for document, field in COUNTERS.items()}
+    stats['low_stock'] = [
+        doc['_id'] for doc in Product._get_collection().find(
+            {'is_active': True, 'stock': {'$lt': settings.LOW_STOCK_THRESHOLD}}, {'_id': 1}
+        )
+    ]
+    stats['reconciled_at'] = timezone.now()
+    StoreStats._get_collection().update_one({'_id': STATS_ID}, {'$set': stats}, upsert=True)
+    return StoreStats.objects.get(id=STATS_ID)
+
+
+def get_stats():
+    """Current dashboard stats, computed on first use"""
+    return StoreStats.objects.filter(id=STATS_ID).first() or reconcile()
+
+
+def connect_signals():
+    for document in COUNTERS:
+        signals.post_save.connect(_document_saved, sender=document)
+        signals.post_delete.connect(_document_deleted, sender=document)
@@ -0,0 +1,221 @@
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+from mongoengine import signals
+from pymongo import ReturnDocument
+
+from .models import Category, Product, SharedVersion, SuggestChange
+
+logger = logging.getLogger(__name__)
+
+# SharedVersion document every worker polls to notice changes made elsewhere;
+# each version's change is logged in SuggestChange under that number
+VERSION_ID = 'suggest'
+
+WORD_START_RE = re.compile(r'\b\w', re.UNICODE)
+
+
+def _keys(name):
+    """Lowercased suffixes of a name starting at each word, e.g. 'red cable', 'cable'"""
+    name = (name or '').lower()
+    return {name[match.start():] for match in WORD_START_RE.finditer(name)}
+
+
+class SuggestIndex:
+    """
+    Sorted arrays of (key, id) entries for prefix lookups, one per kind.
+
+    A prefix query is one bisect plus a short forward scan per kind, so it
+    never touches Mongo. Labels and slugs live in dicts keyed by id.
+    """
+
+    def __init__(self):
+        self.entries = {'product': [], 'category': []}
+        self.labels = {'product': {}, 'category': {}}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        for doc in Product._get_collection().find({'is_active': True}, {'name': 1, 'slug': 1}):
+            index.labels['product'][doc['_id']] = (doc.get('name'), doc.get('slug'))
+        for doc in Category._get_collection().find({}, {'name': 1, 'slug': 1}):
+            index.labels['category'][doc['_id']] = (doc.get('name'), doc.get('slug'))
+        for kind, labels in index.labels.items():
+            index.entries[kind] = sorted(
+                (key, document_id)
+                for document_id, (name, slug) in labels.items()
+                for key in _keys(name)
+            )
+        return index
+
+    def put(self, kind, document_id, name, slug):
+        """Insert or replace one document; name None removes it"""
+        entries = self.entries[kind]
+        with self.lock:
+            old = self.labels[kind].pop(document_id, None)
+            if old is not None:
+                for key in _keys(old[0]):
+                    position = bisect.bisect_left(entries, (key, document_id))
+                    if position < len(entries) and entries[position] == (key, document_id):
+                        del entries[position]
+            if name is not None:
+                self.labels[kind][document_id] = (name, slug)
+                for key in _keys(name):
+                    bisect.insort(entries, (key, document_id))
+
+    def lookup(self, kind, prefix, limit):
+        """Return up to `limit` (name, slug) pairs with a word starting with prefix"""
+        prefix = prefix.lower()
+        entries = self.entries[kind]
+        found = {}
+        with self.lock:
+            position = bisect.bisect_left(entries, (prefix,))
+            while position < len(entries) and len(found) < limit:
+                key, document_id = entries[position]
+                if not key.startswith(prefix):
+                    break
+                if document_id not in found:
+                    found[document_id] = self.labels[kind][document_id]
+                position += 1
+        return list(found.values())
+
+
+_index = None
+_version = 0
+_built_at = 0.0
+_lock = threading.Lock()  # Serialises builds and catch-ups
+_poller_pid = None
+
+
+def _read_version():
+    doc = SharedVersion._get_collection().find_one({'_id': VERSION_ID}, {'version': 1})
+    return (doc or {}).get('version', 0)
+
+
+def _build():
+    global _index, _version, _built_at
+    # Read the version first so changes made during the build are replayed
+    version, started = _read_version(), time.monotonic()
+    _index = SuggestIndex.build()
+    _version, _built_at = version, started
+
+
+def _catch_up():
+    """
+    Bring this worker's index up to the shared version.
+
+    Changes since the index's version are replayed from the change log with
+    put(). The index is rebuilt instead when the log has a gap (entries that
+    expired or were never written), when a change asks for it, or when the
+    index is older than SUGGEST_INDEX_MAX_AGE, which picks up raw writes
+    that bypass the signals.
+    """
+    global _version
+    version = _read_version()
+    if time.monotonic() - _built_at > settings.SUGGEST_INDEX_MAX_AGE:
+        _build()
+        return
+    if version == _version:
+        return
+    changes = list(SuggestChange._get_collection().find({'_id': {'$gt': _version, '$lte': version}}).sort('_id', 1))
+    if [change['_id'] for change in changes] != list(range(_version + 1, version + 1)) or \
+            any(change.get('kind') is None for change in changes):
+        _build()
+        return
+    for change in changes:
+        _index.put(change['kind'], change['document_id'], change.get('name'), change.get('slug'))
+    _version = version
+
+
+def _poll():
+    while True:
+        time.sleep(settings.SUGGEST_VERSION_POLL_SECONDS)
+        try:
+            with _lock:
+                _catch_up()
+        except Exception:
+            logger.exception('Could not refresh the suggest index')
+
+
+def get_index():
+    """
+    Return this worker's index.
+
+    Only the very first call builds synchronously and starts the background
+    thread that polls the shared version every SUGGEST_VERSION_POLL_SECONDS,
+    so requests never wait on Mongo after that.
+    """
+    global _poller_pid
+    if _index is None or _poller_pid != os.getpid():
+        with _lock:
+            if _index is None:
+                _build()
+            # Threads do not survive a fork, so each worker process starts its own
+            if _poller_pid != os.getpid():
+                _poller_pid = os.getpid()
+                threading.Thread(target=_poll, daemon=True).start()
+    return _index
+
+
+def suggest(prefix, limit):
+    """Return {'products': [(name, slug)], 'categories': [(name, slug)]}"""
+    index = get_index()
+    return {
+        'products': index.lookup('product', prefix, limit),
+        'categories': index.lookup('category', prefix, limit),
+    }
+
+
+def _record(kind, document_id, name, slug):
+    """Bump the shared version and log the change under it for the other workers"""
+    doc = SharedVersion._get_collection().find_one_and_update(
+        {'_id': VERSION_ID},
+        {'$inc': {'version': 1}},
+        projection={'version': 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    SuggestChange(id=doc['version'], kind=kind, document_id=document_id, name=name, slug=slug).save()
+    return doc['version']
+
+
+def invalidate():
+    """Make every worker rebuild its index, e.g. after a bulk import"""
+    _record(None, None, None, None)
+
+
+def _apply(kind, document_id, name, slug):
+    """Patch this worker's index in place and log the change for the others"""
+    if _index is not None:
+        _index.put(kind, document_id, name, slug)
+    _record(kind, document_id, name, slug)
+
+
+def _product_saved(sender, document, **kwargs):
+    name = document.name if document.is_active else None
+    _apply('product', document.id, name, document.slug)
+
+
+def _product_deleted(sender, document, **kwargs):
+    _apply('product', document.id, None, None)
+
+
+def _category_saved(sender, document, **kwargs):
+    _apply('category', document.id, document.name, document.slug)
+
+
+def _category_deleted(sender, document, **kwargs):
+    _apply('category', document.id, None, None)
+
+
+def connect_signals():
+    signals.post_save.connect(_product_saved, sender=Product)
+    signals.post_delete.connect(_product_deleted, sender=Product)
+    signals.post_save.connect(_category_saved, sender=Category)
+    signals.post_delete.connect(_category_deleted, sender=Category)
@@ -9,3 +9,28 @@ def multiply(value, arg):
         return float(value) * float(arg)
     except (ValueError, TypeError):
         return 0
+
+@register.simple_tag
+def srcset(variants, source, image_format):
+    """Build a srcset string from the stored variants of one uploaded image"""
+    if not variants or not source:
+        return ''
+    # Variants record the upload's stored path, e.g. media/products/x.jpg
+    source = source.replace('\\', '/').lstrip('/')
+    return ', '.join(
+        f"/{variant['path']} {variant['width']}w"
+        for variant in sorted(variants, key=lambda variant: variant['width'])
+        if variant['source'] == source and variant['format'] == image_format
+    )
+
+@register.inclusion_tag('ecommerce/includes/picture.html')
+def picture(variants, source, alt, css_class, sizes):
+    """Render an image URL, with WebP/JPEG srcsets when it is an upload with variants"""
+    return {
+        'src': source,
+        'webp_srcset': srcset(variants, source, 'webp'),
+        'jpeg_srcset': srcset(variants, source, 'jpeg'),
+        'alt': alt,
+        'css_class': css_class,
+        'sizes': sizes,
+    }
@@ -1,3 +1,1165 @@
-from django.test import TestCase
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest import mock
+from datetime import datetime, timedelta
 
-# Create your tests here.
+import mongoengine
+from bson import ObjectId
+from mongoengine.errors import NotUniqueError
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import metrics, mongo, navigation, recommendations, suggest
+from .analytics import roll_up_sales
+from .management.commands.benchmark_views import CommandCounter, count_mongomock_calls
+from .images import _variants_ready, build_variants, schedule_variants
+from .media import absolute_path, release_file, store_upload
+from .models import (
+    CartItem, Category, MediaFile, Order, OrderLine, Product, Recommendation, SalesRollup, SharedVersion, Slide,
+    StoreStats, SuggestChange
+)
+from .orders import OutOfStock, place_order
+from .pagination import decode_cursor, paginate_by_cursor
+from .profiling import MongoCommandListener, ProfilingMiddleware, RequestProfile, _current
+from .queries import LOW_STOCK_FIELDS, PRODUCT_CARD_FIELDS, ProductRow, cart_lines, product_rows, select_related
+from .recommendations import build_recommendations, related_products, top_pairs_numpy, top_pairs_python
+from .search import InMemorySearch
+from .stats import get_stats, reconcile
+from .suggest import SuggestIndex
+from .templatetags.ecommerce_filters import srcset
+
+try:
+    import mongomock
+except ImportError:  # The Mongo tests are skipped without it
+    mongomock = None
+
+
+@unittest.skipIf(mongomock is None, 'needs the mongomock package')
+@override_settings(PROFILING_LOG_SAMPLE_RATE=0)
+class MongoTestCase(TestCase):
+    """Runs each test against a fresh in-process mongomock database"""
+
+    def setUp(self):
+        mongoengine.disconnect()
+        mongoengine.connect('ecommerce_test', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+        cache.clear()
+        # Each test starts at version 0 of a fresh database, without the navigation poller thread
+        navigation_state = mock.patch.multiple(navigation, _version=0, _poller_pid=os.getpid())
+        navigation_state.start()
+        self.addCleanup(navigation_state.stop)
+
+    def tearDown(self):
+        mongoengine.disconnect()
+        mongo.configure()
+        cache.clear()
+
+    @contextmanager
+    def assertMongoCommands(self, expected):
+        """Fail unless the block sends exactly `expected` Mongo commands"""
+        counter = CommandCounter()
+        with count_mongomock_calls(counter):
+            yield
+        self.assertEqual(sum(counter.commands.values()), expected, dict(counter.commands))
+
+    def use_temporary_media_root(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        return media_root
+
+    def create_product(self, name, category=None, **fields):
+        category = category or Category.objects(slug='general').first() or Category(name='General', slug='general').save()
+        fields.setdefault('price', 10.0)
+        return Product(name=name, slug=name.lower().replace(' ', '-'), category=category, **fields).save()
+
+
+class InMemorySearchTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lamp = self.create_product('Desk Lamp', description='Warm light for a desk')
+        self.desk = self.create_product('Oak Desk', description='Solid oak')
+        self.create_product('Desk Chair', description='For a desk', is_active=False)
+        self.backend = InMemorySearch()
+
+    def test_ranks_name_matches_above_description_matches(self):
+        results = self.backend.search('warm oak', 0, 10)
+        self.assertEqual([product.id for product in results], [self.desk.id, self.lamp.id])
+
+    def test_skips_inactive_products_and_pages(self):
+        results = self.backend.search('desk', 0, 10)
+        self.assertEqual({product.id for product in results}, {self.lamp.id, self.desk.id})
+        self.assertEqual(len(self.backend.search('desk', 1, 10)), 1)
+        self.assertEqual(self.backend.search('sofa', 0, 10), [])
+
+    def test_invalidate_picks_up_new_products(self):
+        self.assertEqual(self.backend.search('sofa', 0, 10), [])
+        sofa = self.create_product('Sofa')
+        self.backend.invalidate()
+        self.assertEqual([product.id for product in self.backend.search('sofa', 0, 10)], [sofa.id])
+
+
+class CursorPaginationTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        start = datetime(2026, 1, 1)
+        # Two products share a timestamp so the id tie-breaker is exercised
+        self.products = [
+            self.create_product(f'Product {i}', created_at=start + timedelta(days=min(i, 3)))
+            for i in range(5)
+        ]
+        self.newest_first = sorted(self.products, key=lambda p: (p.created_at, p.id), reverse=True)
+
+    def ids(self, page):
+        return [product.id for product in page]
+
+    def test_walks_forward_and_back(self):
+        queryset = Product.objects.all()
+        first = paginate_by_cursor(queryset, page_size=2)
+        self.assertEqual(self.ids(first), [p.id for p in self.newest_first[:2]])
+        self.assertFalse(first.has_previous)
+
+        second = paginate_by_cursor(queryset, after=first.next_cursor, page_size=2)
+        self.assertEqual(self.ids(second), [p.id for p in self.newest_first[2:4]])
+        self.assertTrue(second.has_previous)
+
+        last = paginate_by_cursor(queryset, after=second.next_cursor, page_size=2)
+        self.assertEqual(self.ids(last), [self.newest_first[4].id])
+        self.assertFalse(last.has_next)
+
+        back = paginate_by_cursor(queryset, before=second.prev_cursor, page_size=2)
+        self.assertEqual(self.ids(back), self.ids(first))
+        self.assertFalse(back.has_previous)
+        self.assertTrue(back.has_next)
+
+    def test_invalid_cursor_starts_from_the_first_page(self):
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+        page = paginate_by_cursor(Product.objects.all(), after='not-a-cursor', page_size=2)
+        self.assertEqual(self.ids(page), [p.id for p in self.newest_first[:2]])
+
+    @override_settings(PRODUCT_PAGE_SIZE=2)
+    def test_product_list_follows_the_cursor_links(self):
+        first = self.client.get(reverse('product_list')).context['page']
+        self.assertContains(self.client.get(reverse('product_list')), f'?after={first.next_cursor}')
+        second = self.client.get(reverse('product_list'), {'after': first.next_cursor}).context['page']
+        self.assertEqual(self.ids(second), [p.id for p in self.newest_first[2:4]])
+
+
+class SelectRelatedTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.books = Category(name='Books', slug='books').save()
+        self.games = Category(name='Games', slug='games').save()
+        for name, category in [('Novel', self.books), ('Atlas', self.books), ('Chess', self.games)]:
+            product = self.create_product(name, category=category)
+            CartItem(product=product, session_key='session').save()
+
+    def test_loads_every_category_with_one_query(self):
+        products = list(Product.objects.order_by('name'))
+        with self.assertMongoCommands(1):
+            select_related(products, 'category')
+            names = [product.category.name for product in products]
+        self.assertEqual(names, ['Books', 'Games', 'Books'])
+
+    def test_follows_nested_paths(self):
+        items = list(CartItem.objects(session_key='session'))
+        with self.assertMongoCommands(2):
+            select_related(items, 'product__category')
+            names = sorted((item.product.name, item.product.category.slug) for item in items)
+        self.assertEqual(names, [('Atlas', 'books'), ('Chess', 'games'), ('Novel', 'books')])
+
+
+class CartLinesTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lamp = self.create_product('Lamp', price=12.5, stock=3)
+        self.desk = self.create_product('Desk', price=100.0)
+        CartItem(product=self.lamp, quantity=2, session_key='session').save()
+        CartItem(product=self.desk, quantity=1, session_key='session').save()
+        CartItem(product=self.desk, quantity=5, session_key='other').save()
+
+    def test_joins_products_and_totals_in_one_aggregation(self):
+        with self.assertMongoCommands(1):
+            lines, total = cart_lines('session')
+        self.assertEqual(total, 125.0)
+        self.assertEqual([(line.product.name, line.quantity, line.subtotal) for line in lines], [
+            ('Lamp', 2, 25.0),
+            ('Desk', 1, 100.0),
+        ])
+        self.assertEqual((lines[0].product.stock, lines[0].product.category.slug), (3, 'general'))
+
+    def test_skips_lines_of_deleted_products(self):
+        Product._get_collection().delete_one({'_id': self.desk.id})
+        lines, total = cart_lines('session')
+        self.assertEqual(([line.product.name for line in lines], total), (['Lamp'], 25.0))
+
+    def test_empty_cart(self):
+        self.assertEqual(cart_lines('nobody'), ([], 0))
+
+    def test_cart_page_lists_the_session_lines(self):
+        self.client.get(reverse('cart'))
+        CartItem(product=self.lamp, quantity=4, session_key=self.client.session.session_key).save()
+        response = self.client.get(reverse('cart'))
+        self.assertEqual(response.context['total'], 50.0)
+        self.assertContains(response, 'Lamp')
+
+
+class CartSummaryTests(MongoTestCase):
+    # mongomock has no $lookup sub-pipelines, summarize_cart itself needs a real server
+
+    def setUp(self):
+        super().setUp()
+        self.lamp = self.create_product('Lamp', price=12.5)
+        patcher = mock.patch('ecommerce.views.summarize_cart', return_value=(1, 12.5))
+        self.summarize_cart = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.add_to_cart()
+
+    def add_to_cart(self):
+        return self.client.post(
+            reverse('add_to_cart'), json.dumps({'product_id': str(self.lamp.id)}), content_type='application/json'
+        )
+
+    def test_unchanged_cart_is_not_modified_without_a_query(self):
+        response = self.client.get(reverse('cart_summary'))
+        self.assertEqual(response.json(), {'item_count': 1, 'total': 12.5})
+        self.summarize_cart.reset_mock()
+
+        response = self.client.get(reverse('cart_summary'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.summarize_cart.assert_not_called()
+
+    def test_cart_and_price_changes_change_the_etag(self):
+        etag = self.client.get(reverse('cart_summary'))['ETag']
+        self.add_to_cart()
+        response = self.client.get(reverse('cart_summary'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        self.lamp.price = 10.0
+        self.lamp.save()
+        self.assertEqual(self.client.get(reverse('cart_summary'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_session_without_a_cart(self):
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get(reverse('cart_summary')).json(), {'item_count': 0, 'total': 0})
+
+
+class EnsureIndexesTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lamp = self.create_product('Lamp')
+        self.desk = self.create_product('Desk')
+        start = datetime(2026, 1, 1)
+        # Lines written by the old read-modify-write add_to_cart, before the unique index
+        CartItem._get_collection().insert_many([
+            {'session_key': 'session', 'product': self.lamp.id, 'quantity': quantity, 'created_at': start + timedelta(minutes=quantity)}
+            for quantity in (1, 2, 3)
+        ] + [{'session_key': 'session', 'product': self.desk.id, 'quantity': 1, 'created_at': start}])
+
+    def ensure_indexes(self):
+        out = io.StringIO()
+        call_command('ensure_indexes', skip_explain=True, stdout=out)
+        return out.getvalue()
+
+    def test_carts_with_duplicates_still_load(self):
+        self.assertEqual(CartItem.objects(session_key='session').count(), 4)
+
+    def test_merges_duplicate_lines_before_creating_the_unique_index(self):
+        oldest = CartItem._get_collection().find_one({'product': self.lamp.id, 'quantity': 1})['_id']
+        self.assertIn('Merged 2 duplicate cart lines', self.ensure_indexes())
+
+        lines = {line.product.id: line for line in CartItem.objects(session_key='session')}
+        self.assertEqual((lines[self.lamp.id].id, lines[self.lamp.id].quantity), (oldest, 6))
+        self.assertEqual(lines[self.desk.id].quantity, 1)
+        unique = [index for index in CartItem._get_collection().index_information().values() if index.get('unique')]
+        self.assertEqual([index['key'] for index in unique], [[('session_key', 1), ('product', 1)]])
+
+        self.assertNotIn('Merged', self.ensure_indexes())
+
+    def test_creates_the_sales_rollup_index(self):
+        self.ensure_indexes()
+        keys = [index['key'] for index in SalesRollup._get_collection().index_information().values()]
+        self.assertIn([('day', 1)], keys)
+
+
+class MigrateOrderLinesTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lamp = self.create_product('Lamp', price=12.5, image_urls=['https://cdn.example.com/lamp.jpg'])
+        kept = CartItem(product=self.lamp, quantity=2, session_key='old').save()
+        orphan = CartItem(product=self.create_product('Gone'), quantity=1, session_key='old').save()
+        Product._get_collection().delete_one({'name': 'Gone'})
+        self.missing = ObjectId()
+        orders = Order._get_collection()
+        orders.insert_many([
+            {'order_number': 'A', 'customer_id': 'c', 'total_amount': 25.0, 'items': [kept.id]},
+            {'order_number': 'B', 'customer_id': 'c', 'total_amount': 35.0, 'items': [kept.id, orphan.id]},
+            {'order_number': 'C', 'customer_id': 'c', 'total_amount': 5.0, 'items': [self.missing]},
+        ])
+        self.orphan = orphan
+
+    def migrate(self, *args):
+        out = io.StringIO()
+        call_command('migrate_order_lines', *args, stdout=out)
+        return out.getvalue()
+
+    def test_every_order_loads_after_migration(self):
+        output = self.migrate()
+        self.assertIn('Migrated 3 orders', output)
+        self.assertIn('2 of them', output)
+
+        orders = {order.order_number: order for order in Order.objects.all()}
+        line = orders['A'].items[0]
+        self.assertEqual(
+            (line.product_id, line.name, line.category_name, line.unit_price, line.quantity, line.image),
+            (self.lamp.id, 'Lamp', 'General', 12.5, 2, 'https://cdn.example.com/lamp.jpg'),
+        )
+        self.assertEqual(orders['A'].legacy_items, [])
+        self.assertEqual(([line.name for line in orders['B'].items], orders['B'].legacy_items), (['Lamp'], [self.orphan.id]))
+        self.assertEqual((orders['C'].items, orders['C'].legacy_items), ([], [self.missing]))
+        self.assertIn('Migrated 0 orders', self.migrate())
+
+    def test_dry_run_writes_nothing(self):
+        self.assertIn('[dry run] Migrated 3 orders', self.migrate('--dry-run'))
+        self.assertEqual(Order._get_collection().count_documents({'items': {'$type': 'objectId'}}), 3)
+
+
+class CartMutationTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lamp = self.create_product('Lamp')
+
+    def post(self, name, **data):
+        return self.client.post(reverse(name), json.dumps(data), content_type='application/json').json()
+
+    def lines(self):
+        return list(CartItem.objects(session_key=self.client.session.session_key))
+
+    def test_adding_twice_increments_one_line(self):
+        self.post('add_to_cart', product_id=str(self.lamp.id))
+        result = self.post('add_to_cart', product_id=str(self.lamp.id), quantity=3)
+        self.assertEqual((result['quantity'], result['cart_count']), (4, 1))
+        self.assertEqual([line.quantity for line in self.lines()], [4])
+
+    def test_concurrent_insert_is_retried_as_an_increment(self):
+        from . import views
+        calls = []
+
+        def increment(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise NotUniqueError()
+            return real(*args)
+
+        real = views.increment_cart_item
+        with mock.patch.object(views, 'increment_cart_item', side_effect=increment):
+            self.assertEqual(self.post('add_to_cart', product_id=str(self.lamp.id))['quantity'], 1)
+        self.assertEqual(len(calls), 2)
+
+    def test_rejects_unknown_and_inactive_products(self):
+        self.create_product('Old', is_active=False)
+        for product_id in ['not-an-id', str(ObjectId()), str(Product.objects.get(name='Old').id)]:
+            self.assertFalse(self.post('add_to_cart', product_id=product_id)['success'])
+        self.assertEqual(self.lines(), [])
+
+    def test_update_and_remove_only_touch_the_session_cart(self):
+        item_id = self.post('add_to_cart', product_id=str(self.lamp.id))['item_id']
+        other = CartItem(product=self.lamp, quantity=1, session_key='other').save()
+
+        self.assertEqual(self.post('update_cart', item_id=item_id, quantity=5)['quantity'], 5)
+        self.assertFalse(self.post('update_cart', item_id=str(other.id), quantity=5)['success'])
+        self.assertFalse(self.post('remove_from_cart', item_id=str(other.id))['success'])
+        self.assertEqual(other.reload().quantity, 1)
+
+        self.assertEqual(self.post('update_cart', item_id=item_id, quantity=0)['cart_count'], 0)
+        self.assertFalse(self.post('remove_from_cart', item_id=item_id)['success'])
+
+
+class PlaceOrderTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lamp = self.create_product('Lamp', stock=5)
+        self.desk = self.create_product('Desk', stock=1)
+
+    def add_to_cart(self, product, quantity):
+        return CartItem(product=product, quantity=quantity, session_key='session').save()
+
+    def test_reserves_stock_and_clears_the_cart(self):
+        items = [self.add_to_cart(self.lamp, 2), self.add_to_cart(self.desk, 1)]
+        order = place_order('customer', 'session', items, 30.0, 'Address')
+
+        self.assertEqual(Order.objects.get(id=order.id).order_number, order.order_number)
+        self.lamp.reload()
+        self.desk.reload()
+        self.assertEqual((self.lamp.stock, self.desk.stock), (3, 0))
+        self.assertEqual(self.lamp.reservations, [])
+        self.assertEqual(CartItem.objects(session_key='session').count(), 0)
+
+    def test_keeps_lines_added_after_the_cart_was_read(self):
+        items = [self.add_to_cart(self.lamp, 1)]
+        added_meanwhile = self.add_to_cart(self.desk, 1)
+        place_order('customer', 'session', items, 10.0, 'Address')
+
+        self.assertEqual([line.id for line in CartItem.objects(session_key='session')], [added_meanwhile.id])
+        self.assertEqual(self.desk.reload().stock, 1)
+
+    def test_checkout_orders_the_cart_lines(self):
+        user = User.objects.create_user('shopper', password='secret')
+        self.client.force_login(user)
+        self.client.get(reverse('cart'))
+        CartItem(product=self.lamp, quantity=2, session_key=self.client.session.session_key).save()
+
+        response = self.client.post(reverse('checkout'), {'shipping_address': '1 Main St'})
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('order_confirmation', args=[order.id]), fetch_redirect_response=False)
+        self.assertEqual([(line.name, line.quantity, line.unit_price) for line in order.items], [('Lamp', 2, 10.0)])
+        self.assertEqual(order.total_amount, 20.0)
+
+    def test_rolls_back_when_a_line_is_short(self):
+        items = [self.add_to_cart(self.lamp, 2), self.add_to_cart(self.desk, 2)]
+        with self.assertRaises(OutOfStock) as raised:
+            place_order('customer', 'session', items, 40.0, 'Address')
+
+        self.assertEqual(raised.exception.product_names, ['Desk'])
+        self.lamp.reload()
+        self.desk.reload()
+        self.assertEqual((self.lamp.stock, self.desk.stock), (5, 1))
+        self.assertEqual(self.lamp.reservations, [])
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(CartItem.objects(session_key='session').count(), 2)
+
+
+class PageCacheTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lamp = self.create_product('Lamp')
+        self.shade = self.create_product('Shade')
+        self.desk = self.create_product('Desk', category=Category(name='Office', slug='office').save())
+        Recommendation(id=self.lamp.id, related=[self.shade.id], scores=[1.0]).save()
+        self.url = reverse('product_detail', args=['lamp'])
+
+    def cache_status(self, url=None):
+        response = self.client.get(url or self.url)
+        self.assertEqual(response.status_code, 200)
+        return response['X-Page-Cache']
+
+    def test_hit_until_the_product_changes(self):
+        self.assertEqual([self.cache_status(), self.cache_status()], ['miss', 'hit'])
+        self.desk.save()
+        self.assertEqual(self.cache_status(), 'hit')
+        self.lamp.description = 'Brighter'
+        self.lamp.save()
+        self.assertEqual(self.cache_status(), 'miss')
+
+    def test_related_product_changes_purge_the_page(self):
+        self.assertContains(self.client.get(self.url), 'Shade')
+        self.shade.price = 5.0
+        self.shade.save()
+        self.assertEqual(self.cache_status(), 'miss')
+        self.shade.is_active = False
+        self.shade.save()
+        self.assertNotContains(self.client.get(self.url), 'Shade')
+
+    def test_change_while_rendering_is_not_cached_as_current(self):
+        from . import views
+        real = views.recommended_products
+
+        def save_meanwhile(product):
+            Product.objects.get(id=self.lamp.id).save()
+            return real(product)
+
+        with mock.patch.object(views, 'recommended_products', side_effect=save_meanwhile):
+            self.assertEqual(self.cache_status(), 'miss')
+        self.assertEqual(self.cache_status(), 'miss')
+        self.assertEqual(self.cache_status(), 'hit')
+
+    def test_logged_in_users_bypass_the_cache(self):
+        self.client.force_login(User.objects.create_user('shopper'))
+        self.client.get(self.url)
+        self.assertNotIn('X-Page-Cache', self.client.get(self.url))
+
+
+class ImageVariantTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        from PIL import Image
+
+        self.media_root = self.use_temporary_media_root()
+        os.makedirs(os.path.join(self.media_root, 'products'))
+        self.source = 'media/products/photo.png'
+        Image.new('RGB', (1000, 500), 'red').save(os.path.join(self.media_root, 'products', 'photo.png'))
+
+    def test_builds_webp_and_jpeg_variants_narrower_than_the_original(self):
+        from PIL import Image
+
+        variants = build_variants(self.media_root, self.source, [1600, 160, 400])
+        self.assertEqual(
+            [(variant['width'], variant['format'], variant['path']) for variant in variants],
+            [
+                (160, 'webp', 'media/products/variants/photo_160.webp'),
+                (160, 'jpeg', 'media/products/variants/photo_160.jpg'),
+                (400, 'webp', 'media/products/variants/photo_400.webp'),
+                (400, 'jpeg', 'media/products/variants/photo_400.jpg'),
+            ],
+        )
+        with Image.open(os.path.join(self.media_root, 'products', 'variants', 'photo_400.webp')) as image:
+            self.assertEqual(image.size, (400, 200))
+
+    @override_settings(IMAGE_VARIANT_WIDTHS={'products': [160, 400]})
+    def test_scheduled_variants_are_stored_on_the_document(self):
+        product = self.create_product('Lamp', image_files=[self.source])
+        executor = ThreadPoolExecutor(max_workers=1)
+        with mock.patch('ecommerce.images.get_executor', return_value=executor):
+            schedule_variants(product, [self.source], 'products')
+        executor.shutdown(wait=True)
+
+        product.reload()
+        self.assertEqual(sorted((v['width'], v['format']) for v in product.image_variants), [
+            (160, 'jpeg'), (160, 'webp'), (400, 'jpeg'), (400, 'webp'),
+        ])
+        self.assertEqual(
+            srcset(product.image_variants, '/' + self.source, 'webp'),
+            '/media/products/variants/photo_160.webp 160w, /media/products/variants/photo_400.webp 400w',
+        )
+        self.assertEqual(srcset(product.image_variants, '/media/products/other.png', 'webp'), '')
+
+    def test_failed_builds_leave_the_document_unchanged(self):
+        product = self.create_product('Lamp', image_files=[self.source])
+        future = Future()
+        future.set_exception(OSError('cannot identify image file'))
+        with self.assertLogs('ecommerce.images', 'ERROR'):
+            _variants_ready(Product, product.id, self.source)(future)
+        self.assertEqual(product.reload().image_variants, [])
+
+
+class MediaRefcountTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = self.use_temporary_media_root()
+
+    def upload(self, content=b'image bytes', name='photo.JPG'):
+        return store_upload(SimpleUploadedFile(name, content), 'products')
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.upload()
+        second = self.upload(name='copy.jpg')
+
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith('media/products/') and first.endswith('.jpg'))
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'products')), [os.path.basename(first)])
+        self.assertEqual(MediaFile.objects.get(path=first).references, 2)
+
+    def test_different_content_is_stored_separately(self):
+        self.assertNotEqual(self.upload(b'one'), self.upload(b'two'))
+
+    def test_last_release_drops_the_record_and_leaves_the_file_to_gc(self):
+        path = self.upload()
+        self.upload()
+
+        release_file(path)
+        self.assertEqual(MediaFile.objects.get(path=path).references, 1)
+        release_file(path)
+        self.assertEqual(MediaFile.objects(path=path).count(), 0)
+        self.assertTrue(os.path.exists(absolute_path(path)))
+
+    def test_upload_racing_the_last_release_keeps_its_file(self):
+        path = self.upload()
+
+        def upload_meanwhile():
+            # The releaser removed the record; a new upload of the same content lands now
+            MediaFile._get_collection().delete_one({'_id': path})
+            self.assertEqual(self.upload(), path)
+            return 1
+
+        with mock.patch('mongoengine.queryset.QuerySet.delete', side_effect=upload_meanwhile):
+            release_file(path)
+        self.assertTrue(os.path.exists(absolute_path(path)))
+        self.assertEqual(MediaFile.objects.get(path=path).references, 1)
+
+    def test_product_delete_releases_its_files(self):
+        path = self.upload()
+        product = self.create_product('Lamp', image_files=[path])
+        product.delete()
+        self.assertEqual(MediaFile.objects(path=path).count(), 0)
+
+
+class GcMediaTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = self.use_temporary_media_root()
+        self.kept = store_upload(SimpleUploadedFile('kept.jpg', b'kept'), 'products')
+        self.orphan = store_upload(SimpleUploadedFile('orphan.jpg', b'orphan'), 'products')
+        release_file(self.orphan)
+        variants = os.path.join(self.media_root, 'products', 'variants')
+        os.makedirs(variants)
+        for name in ('kept_160.webp', 'orphan_160.webp'):
+            open(os.path.join(variants, name), 'wb').close()
+        self.create_product('Lamp', image_files=[self.kept], image_variants=[
+            {'source': self.kept, 'width': 160, 'format': 'webp', 'path': 'media/products/variants/kept_160.webp'},
+        ])
+        self.age_files()
+
+    def age_files(self):
+        an_hour_ago = time.time() - 3600
+        for directory, _, files in os.walk(self.media_root):
+            for name in files:
+                os.utime(os.path.join(directory, name), (an_hour_ago, an_hour_ago))
+
+    def files(self):
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), self.media_root)
+            for directory, _, files in os.walk(self.media_root) for name in files
+        )
+
+    def gc(self, *args):
+        out = io.StringIO()
+        call_command('gc_media', '--grace-seconds', '60', *args, stdout=out)
+        return out.getvalue()
+
+    def test_deletes_only_unreferenced_files(self):
+        self.assertIn('Deleted 2 orphans', self.gc())
+        self.assertEqual(self.files(), [
+            os.path.join('products', os.path.basename(self.kept)),
+            os.path.join('products', 'variants', 'kept_160.webp'),
+        ])
+
+    def test_dry_run_and_grace_period(self):
+        self.assertIn('Would delete 2 orphans', self.gc('--dry-run'))
+        self.assertEqual(len(self.files()), 4)
+        self.assertIn('Would delete 0 orphans', self.gc('--dry-run', '--grace-seconds', '7200'))
+
+    def test_deduplicated_upload_restarts_the_grace_period(self):
+        self.assertEqual(store_upload(SimpleUploadedFile('again.jpg', b'orphan'), 'products'), self.orphan)
+        self.gc()
+        self.assertTrue(os.path.exists(absolute_path(self.orphan)))
+        self.assertEqual(MediaFile.objects.get(path=self.orphan).references, 1)
+
+
+class StoreStatsTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lamp = self.create_product('Lamp', stock=50)
+        self.desk = self.create_product('Desk', stock=2)
+
+    def test_first_read_reconciles(self):
+        self.assertEqual(StoreStats.objects.count(), 0)
+        stats = get_stats()
+        self.assertEqual((stats.products, stats.categories, stats.orders), (2, 1, 0))
+        self.assertEqual(stats.low_stock, [self.desk.id])
+
+    def test_saves_and_deletes_update_the_counters(self):
+        get_stats()
+        chair = self.create_product('Chair', stock=1)
+        self.desk.stock = 20
+        self.desk.save()
+        self.lamp.delete()
+        stats = get_stats()
+        self.assertEqual(stats.products, 2)
+        self.assertEqual(stats.low_stock, [chair.id])
+
+        chair.is_active = False
+        chair.save()
+        self.assertEqual(get_stats().low_stock, [])
+
+    def test_checkout_refreshes_low_stock(self):
+        get_stats()
+        item = CartItem(product=self.lamp, quantity=45, session_key='session').save()
+        place_order('customer', 'session', [item], 450.0, 'Address')
+        self.assertEqual(sorted(get_stats().low_stock), sorted([self.lamp.id, self.desk.id]))
+
+    def test_reconcile_stats_reports_drift(self):
+        get_stats()
+        Product._get_collection().insert_one({'name': 'Raw', 'price': 1.0, 'stock': 100})
+        out = io.StringIO()
+        call_command('reconcile_stats', stdout=out)
+        self.assertIn('products: 3 (was 2)', out.getvalue())
+        self.assertEqual(reconcile().products, 3)
+
+    def test_dashboard_shows_the_stored_counters(self):
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual((response.context['total_products'], response.context['total_categories']), (2, 1))
+        self.assertEqual([product.name for product in response.context['low_stock_products']], ['Desk'])
+
+
+class SalesRollupTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.created = timezone.now() - timedelta(hours=2)
+        self.order = self.create_order('pending', OrderLine(name='Lamp', category_name='Lighting', unit_price=20.0, quantity=2))
+        self.create_order('pending', OrderLine(name='Desk', category_name='Furniture', unit_price=100.0, quantity=1))
+        roll_up_sales(upto=self.created + timedelta(minutes=1))
+
+    def create_order(self, status, *items):
+        total = sum(item.subtotal for item in items)
+        return Order(customer_id='customer', items=list(items), total_amount=total, status=status,
+                     created_at=self.created, updated_at=self.created).save()
+
+    def buckets(self):
+        return {(bucket.category, bucket.status): (bucket.revenue, bucket.units, bucket.orders)
+                for bucket in SalesRollup.objects.all()}
+
+    def test_rolls_up_new_orders_once(self):
+        self.assertEqual(self.buckets(), {('Lighting', 'pending'): (40.0, 2, 1), ('Furniture', 'pending'): (100.0, 1, 1)})
+        roll_up_sales()
+        self.assertEqual(self.buckets()[('Lighting', 'pending')], (40.0, 2, 1))
+
+    def test_status_changes_move_the_order_between_buckets(self):
+        self.order.status = 'shipped'
+        self.order.save()
+        roll_up_sales()
+        self.assertEqual(self.buckets(), {('Lighting', 'shipped'): (40.0, 2, 1), ('Furniture', 'pending'): (100.0, 1, 1)})
+        self.assertEqual(Order.objects.get(id=self.order.id).rolled_up_status, 'shipped')
+
+        self.order.status = 'cancelled'
+        self.order.save()
+        roll_up_sales()
+        self.assertEqual(self.buckets()[('Lighting', 'cancelled')], (40.0, 2, 1))
+        self.assertNotIn(('Lighting', 'shipped'), self.buckets())
+
+    def test_rebuild_matches_the_incremental_totals(self):
+        self.order.status = 'delivered'
+        self.order.save()
+        roll_up_sales()
+        incremental = self.buckets()
+        roll_up_sales(rebuild=True)
+        self.assertEqual(self.buckets(), incremental)
+
+
+class SuggestTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # A fresh worker whose poller thread counts as started, tests call _catch_up() directly
+        state = mock.patch.multiple(suggest, _index=None, _version=0, _built_at=0.0, _poller_pid=os.getpid())
+        state.start()
+        self.addCleanup(state.stop)
+        self.create_product('Red Cable')
+        self.create_product('Cable Tie')
+        self.create_product('Cable Box', is_active=False)
+        self.desk = self.create_product('Desk')
+
+    def test_prefix_lookup_matches_word_starts(self):
+        index = SuggestIndex.build()
+        self.assertEqual(sorted(name for name, slug in index.lookup('product', 'CAB', 10)), ['Cable Tie', 'Red Cable'])
+        self.assertEqual(len(index.lookup('product', 'cab', 1)), 1)
+        self.assertEqual(index.lookup('category', 'gen', 10), [('General', 'general')])
+        self.assertEqual(index.lookup('product', 'lamp', 10), [])
+
+    def test_put_replaces_and_removes(self):
+        index = SuggestIndex.build()
+        index.put('product', self.desk.id, 'Standing Table', 'standing-table')
+        self.assertEqual(index.lookup('product', 'desk', 10), [])
+        self.assertEqual(index.lookup('product', 'table', 10), [('Standing Table', 'standing-table')])
+        index.put('product', self.desk.id, None, None)
+        self.assertEqual(index.lookup('product', 'stand', 10), [])
+        self.assertNotIn(self.desk.id, {document_id for key, document_id in index.entries['product']})
+
+    def test_saves_patch_this_workers_index(self):
+        suggest.get_index()
+        sofa = self.create_product('Sofa')
+        self.assertEqual(suggest.suggest('so', 10)['products'], [('Sofa', 'sofa')])
+        self.assertEqual(SuggestChange.objects.get(name='Sofa').document_id, sofa.id)
+
+    def test_other_workers_replay_the_change_log(self):
+        suggest.get_index()
+        # Changes made by another worker only reach this one through the log
+        with mock.patch.object(suggest, '_index', None):
+            self.create_product('Sofa')
+            self.desk.delete()
+        with mock.patch.object(SuggestIndex, 'build') as build:
+            suggest._catch_up()
+        build.assert_not_called()
+        self.assertEqual(suggest.suggest('so', 10)['products'], [('Sofa', 'sofa')])
+        self.assertEqual(suggest.suggest('desk', 10)['products'], [])
+
+    def test_invalidate_and_log_gaps_rebuild(self):
+        suggest.get_index()
+        suggest.invalidate()
+        with mock.patch.object(SuggestIndex, 'build', wraps=SuggestIndex.build) as build:
+            suggest._catch_up()
+        self.assertEqual(build.call_count, 1)
+
+        self.create_product('Sofa')
+        SuggestChange.objects.delete()
+        with mock.patch.object(SuggestIndex, 'build', wraps=SuggestIndex.build) as build:
+            suggest._catch_up()
+        self.assertEqual(build.call_count, 1)
+
+
+class CatalogImportExportTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        lighting = Category(name='Lighting', slug='lighting').save()
+        self.create_product('Desk Lamp', category=lighting, description='Warm light', price=19.5, stock=3,
+                            image_urls=['https://example.com/a.jpg', 'https://example.com/b.jpg'])
+        self.create_product('Floor Lamp', category=lighting, price=45.0, is_active=False)
+
+    def catalog(self):
+        return sorted(
+            (product.slug, product.name, product.description or '', product.price, product.stock, product.category.slug,
+             product.is_active, product.image_urls, product.primary_image)
+            for product in Product.objects.all()
+        )
+
+    def round_trip(self, filename):
+        path = os.path.join(self.directory, filename)
+        before = self.catalog()
+        call_command('export_catalog', path, stdout=io.StringIO())
+        Product.objects.delete()
+        call_command('import_catalog', path, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(self.catalog(), before)
+
+    def test_csv_round_trip(self):
+        self.round_trip('products.csv')
+
+    def test_jsonl_round_trip(self):
+        self.round_trip('products.jsonl')
+
+    def test_skips_rows_that_are_not_objects(self):
+        path = os.path.join(self.directory, 'products.jsonl')
+        with open(path, 'w') as stream:
+            stream.write('["not", "an", "object"]\n"text"\n{not json\n')
+            stream.write(json.dumps({'name': 'Sofa', 'price': 300, 'category': 'lighting'}) + '\n')
+        stderr = io.StringIO()
+        call_command('import_catalog', path, stdout=io.StringIO(), stderr=stderr)
+        self.assertIn('expected a JSON object, got list', stderr.getvalue())
+        self.assertEqual(stderr.getvalue().count('Skipped row'), 3)
+        self.assertTrue(Product.objects(name='Sofa', slug='sofa').first())
+
+
+class ProfilingTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.listener = MongoCommandListener()
+        self.request_ids = iter(range(1, 1000))
+
+    def send(self, command_name, command, duration_micros=2000):
+        """Feed the listener one command the way pymongo would"""
+        event = SimpleNamespace(command_name=command_name, command=command, request_id=next(self.request_ids),
+                                duration_micros=duration_micros)
+        self.listener.started(event)
+        self.listener.succeeded(event)
+
+    def profile(self, get_response, **settings):
+        with self.settings(**settings):
+            middleware = ProfilingMiddleware(get_response)
+        return middleware(RequestFactory().get('/products/'))
+
+    def find_category_twice(self, request):
+        self.send('find', {'find': 'categories', 'filter': {'_id': 1}, 'lsid': 'a'})
+        self.send('find', {'find': 'categories', 'filter': {'_id': 1}, 'lsid': 'b'})
+        self.send('find', {'find': 'products', 'filter': {}})
+        self.send('getMore', {'getMore': 42, 'collection': 'products'})
+        return HttpResponse('ok')
+
+    def test_attributes_commands_to_the_current_request(self):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            self.find_category_twice(None)
+        finally:
+            _current.reset(token)
+        self.send('find', {'find': 'orders'})  # Outside any request
+
+        self.assertEqual(len(profile.commands), 4)
+        self.assertEqual(profile.collections, {'categories': 2, 'products': 2})
+        self.assertAlmostEqual(profile.mongo_ms, 8.0)
+        self.assertEqual([(key[:2], count) for key, count in profile.duplicates()], [(('find', 'categories'), 2)])
+
+    def test_server_timing_header(self):
+        self.create_product('Lamp')
+        response = self.client.get(reverse('home'))
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^mongo;dur=[\d.]+;desc="\d+ commands", view;dur=[\d.]+, template;dur=[\d.]+, total;dur=[\d.]+$'
+        )
+        self.assertNotIn('Server-Timing', self.profile(self.find_category_twice, PROFILING_SERVER_TIMING=False))
+
+    def test_sampled_log_line_and_debug_duplicates(self):
+        with self.assertLogs('ecommerce.profiling', 'INFO') as logs:
+            response = self.profile(self.find_category_twice, PROFILING_LOG_SAMPLE_RATE=1, DEBUG=True)
+        self.assertIn('mongo;dur=8.0;desc="4 commands"', response['Server-Timing'])
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line['path'], line['mongo_commands']), ('/products/', 4))
+        self.assertEqual(line['collections'], {'categories': 2, 'products': 2})
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn('sent the same find on categories 2 times', logs.records[1].getMessage())
+
+        with mock.patch('ecommerce.profiling.logger') as logger:
+            self.profile(self.find_category_twice, PROFILING_LOG_SAMPLE_RATE=0, DEBUG=False)
+        logger.info.assert_not_called()
+        logger.warning.assert_not_called()
+
+
+@override_settings(PROFILING_LOG_SAMPLE_RATE=0)
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        # Fake worker pids, this process's own file is left to the middleware
+        self.live, self.exited = os.getpid() + 1, os.getpid() + 2
+        alive = mock.patch('ecommerce.metrics._is_alive', lambda pid: pid == self.live)
+        alive.start()
+        self.addCleanup(alive.stop)
+        self.write(self.live, {'http_responses_total{status="200",view="home"}': 2, 'mongo_pool_connections': 3})
+        self.write(self.exited, {'http_responses_total{status="200",view="home"}': 5, 'mongo_pool_connections': 4,
+                                 'uploads_total': 1})
+        metrics._write(os.path.join(self.directory, metrics.ARCHIVE_FILE),
+                       {'http_responses_total{status="200",view="home"}': 10})
+
+    def write(self, pid, series):
+        metrics._write(os.path.join(self.directory, f'metrics-{pid}.db'), series)
+
+    def test_collect_sums_workers_and_archives_exited_ones(self):
+        expected = {'http_responses_total{status="200",view="home"}': 17, 'mongo_pool_connections': 3, 'uploads_total': 1}
+        self.assertEqual(metrics.collect(self.directory), expected)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, f'metrics-{self.exited}.db')))
+        # Exited workers' gauges are dropped, their counters are kept once
+        self.assertEqual(metrics._read(os.path.join(self.directory, metrics.ARCHIVE_FILE)),
+                         {'http_responses_total{status="200",view="home"}': 15, 'uploads_total': 1})
+        self.assertEqual(metrics.collect(self.directory), expected)
+
+    def test_archive_skips_files_already_archived(self):
+        metrics.archive(self.directory, [self.exited])
+        metrics.archive(self.directory, [self.exited])
+        self.assertEqual(metrics.collect(self.directory)['http_responses_total{status="200",view="home"}'], 17)
+
+    def test_endpoint_is_closed_unless_the_address_is_allowed(self):
+        # A fresh file for this process, so the shared one is not moved into the temporary directory
+        metrics_file = mock.patch('ecommerce.metrics._file', metrics.MetricsFile())
+        metrics_file.start()
+        self.addCleanup(metrics_file.stop)
+        with self.settings(METRICS_DIR=self.directory, METRICS_ALLOWED_IPS=[]):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with self.settings(METRICS_DIR=self.directory, METRICS_ALLOWED_IPS=['127.0.0.1']):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE http_responses_total counter\nhttp_responses_total{status="200",view="home"} 17\n', body)
+        self.assertIn('# TYPE mongo_pool_connections gauge\nmongo_pool_connections 3\n', body)
+
+
+class ProductRowsTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.books = Category(name='Books', slug='books').save()
+        self.games = Category(name='Games', slug='games').save()
+        self.novel = self.create_product('Novel', category=self.books, description='A long story', stock=4,
+                                         image_urls=['https://example.com/novel.jpg'])
+        self.create_product('Atlas', category=self.books)
+        self.create_product('Chess', category=self.games)
+
+    def test_reads_only_the_projected_fields(self):
+        row = product_rows(Product.objects.filter(id=self.novel.id), LOW_STOCK_FIELDS)[0]
+        self.assertIsInstance(row, ProductRow)
+        self.assertEqual((row.id, row.name, row.price, row.stock), (self.novel.id, 'Novel', 10.0, 4))
+        self.assertIsNone(row.description)
+        self.assertIsNone(row.primary_image)
+        self.assertEqual(row.image_variants, [])
+
+        row = product_rows(Product.objects.filter(id=self.novel.id), PRODUCT_CARD_FIELDS)[0]
+        self.assertEqual((row.description, row.primary_image), ('A long story', 'https://example.com/novel.jpg'))
+        self.assertIsNone(row.stock)
+
+    def test_loads_every_category_with_one_query(self):
+        with self.assertMongoCommands(2):
+            rows = product_rows(Product.objects.order_by('name'), PRODUCT_CARD_FIELDS)
+        self.assertEqual([(row.name, row.category.slug) for row in rows],
+                         [('Atlas', 'books'), ('Chess', 'games'), ('Novel', 'books')])
+
+    def test_missing_categories_are_none(self):
+        self.games.delete()
+        rows = product_rows(Product.objects.filter(name='Chess'), PRODUCT_CARD_FIELDS)
+        self.assertIsNone(rows[0].category)
+        self.assertIsNone(product_rows(Product.objects.filter(name='Atlas'), ('name', 'price'))[0].category)
+
+    def test_list_views_render_rows(self):
+        response = self.client.get(reverse('home'))
+        self.assertTrue(all(isinstance(row, ProductRow) for row in response.context['featured_products']))
+        self.assertContains(response, 'https://example.com/novel.jpg')
+        response = self.client.get(reverse('product_list'))
+        self.assertTrue(all(isinstance(row, ProductRow) for row in response.context['page']))
+        self.assertContains(response, reverse('product_detail', args=['novel']))
+
+
+class PrimaryImageTests(MongoTestCase):
+
+    def test_product_save_derives_gallery_and_primary_image(self):
+        product = self.create_product('Lamp', image_files=['media/products/a.jpg'],
+                                      image_urls=['https://example.com/b.jpg'], images=['legacy\\c.jpg'])
+        stored = Product._get_collection().find_one({'_id': product.id})
+        self.assertEqual(stored['gallery'], ['/media/products/a.jpg', 'https://example.com/b.jpg', '/legacy/c.jpg'])
+        self.assertEqual(stored['primary_image'], '/media/products/a.jpg')
+
+        product.image_files = []
+        product.save()
+        self.assertEqual(Product.objects.get(id=product.id).primary_image, 'https://example.com/b.jpg')
+        self.assertIsNone(self.create_product('Desk').primary_image)
+
+    def test_slide_save_prefers_the_uploaded_file(self):
+        slide = Slide(title='Sale', image_url='https://example.com/sale.jpg', image_file='media/slides/sale.jpg').save()
+        self.assertEqual(slide.primary_image, '/media/slides/sale.jpg')
+        slide.image_file = None
+        slide.save()
+        self.assertEqual(Slide.objects.get(id=slide.id).primary_image, 'https://example.com/sale.jpg')
+
+    def test_backfill_migrates_legacy_fields(self):
+        product_id = Product._get_collection().insert_one(
+            {'name': 'Old Lamp', 'price': 5.0, 'images': ['media/old.jpg', 'https://example.com/old.jpg']}
+        ).inserted_id
+        slide_id = Slide._get_collection().insert_one({'title': 'Old', 'image': 'media\\slides\\old.jpg'}).inserted_id
+        self.create_product('Current', image_urls=['https://example.com/current.jpg'])
+
+        out = io.StringIO()
+        call_command('backfill_images', '--dry-run', stdout=out)
+        self.assertIn('[dry run] Updated 1 products and 1 slides', out.getvalue())
+        self.assertNotIn('primary_image', Product._get_collection().find_one({'_id': product_id}))
+
+        call_command('backfill_images', '--batch-size', '1', stdout=io.StringIO())
+        product = Product._get_collection().find_one({'_id': product_id})
+        self.assertNotIn('images', product)
+        self.assertEqual(product['image_urls'], ['/media/old.jpg', 'https://example.com/old.jpg'])
+        self.assertEqual((product['gallery'], product['primary_image']),
+                         (['/media/old.jpg', 'https://example.com/old.jpg'], '/media/old.jpg'))
+        slide = Slide._get_collection().find_one({'_id': slide_id})
+        self.assertNotIn('image', slide)
+        self.assertEqual((slide['image_url'], slide['primary_image']), ('/media/slides/old.jpg', '/media/slides/old.jpg'))
+
+        out = io.StringIO()
+        call_command('backfill_images', stdout=out)
+        self.assertIn('Updated 0 products and 0 slides', out.getvalue())
+
+
+class NavigationTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.books = Category(name='Books', slug='books').save()
+        self.games = Category(name='Games', slug='games').save()
+        self.create_product('Novel', category=self.books)
+        self.create_product('Atlas', category=self.books, is_active=False)
+
+    def counts(self):
+        return [(category['slug'], category['product_count']) for category in navigation.get_categories()]
+
+    def test_counts_active_products_and_caches_them(self):
+        self.assertEqual(self.counts(), [('books', 1), ('games', 0)])
+        with self.assertMongoCommands(0):
+            self.assertEqual(self.counts(), [('books', 1), ('games', 0)])
+
+    def test_changes_in_this_worker_rebuild_at_once(self):
+        self.counts()
+        self.create_product('Chess', category=self.games)
+        self.assertEqual(self.counts(), [('books', 1), ('games', 1)])
+        self.books.delete()
+        self.assertEqual(self.counts(), [('games', 1)])
+
+    def test_other_workers_changes_are_picked_up_by_the_poller(self):
+        self.counts()
+        # Another worker's change: raw writes, then its bump of the shared version
+        Product._get_collection().insert_one({'name': 'Chess', 'price': 5.0, 'is_active': True, 'category': self.games.id})
+        SharedVersion._get_collection().update_one({'_id': navigation.VERSION_ID}, {'$inc': {'version': 1}}, upsert=True)
+        self.assertEqual(self.counts(), [('books', 1), ('games', 0)])
+
+        class Stop(Exception):
+            pass
+
+        with mock.patch('ecommerce.navigation.time.sleep', side_effect=[None, Stop]):
+            with self.assertRaises(Stop):
+                navigation._poll()
+        self.assertEqual(self.counts(), [('books', 1), ('games', 1)])
+
+    def test_first_read_in_a_process_starts_the_poller(self):
+        # Setting up the catalog bumped the shared version once per save
+        with mock.patch.object(navigation, '_version', 0), mock.patch.object(navigation, '_poller_pid', None), \
+                mock.patch('ecommerce.navigation.threading.Thread') as thread:
+            self.assertEqual(navigation.current_version(), 4)
+            navigation.current_version()
+        thread.assert_called_once_with(target=navigation._poll, daemon=True)
+        thread.return_value.start.assert_called_once_with()
+
+
+class RecommendationTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        start = timezone.now() - timedelta(days=1)
+        self.lamp, self.desk, self.chair, self.rug = [
+            self.create_product(name, created_at=start + timedelta(hours=hour))
+            for hour, name in enumerate(['Lamp', 'Desk', 'Chair', 'Rug'])
+        ]
+        self.order(self.lamp, self.desk)
+        self.order(self.lamp, self.desk, self.chair)
+        self.order(self.lamp, self.chair)
+        self.order(self.lamp, self.rug, status='cancelled')
+
+    def order(self, *products, status='pending'):
+        items = [OrderLine(product_id=product.id, name=product.name, unit_price=product.price) for product in products]
+        Order(customer_id='customer', items=items, total_amount=0, status=status).save()
+
+    def related(self, product):
+        return [row.name for row in related_products(product)]
+
+    @unittest.skipIf(recommendations.np is None, 'needs numpy')
+    def test_numpy_and_python_pairs_agree(self):
+        generator = random.Random(7)
+        baskets = [generator.sample(range(40), generator.randint(2, 8)) for _ in range(300)]
+        for top_k in (1, 3, 100):
+            self.assertEqual(dict(top_pairs_numpy(baskets, 40, top_k)), top_pairs_python(baskets, 40, top_k))
+
+    def test_ranks_co_purchases_and_tops_up_from_the_category(self):
+        for np in (recommendations.np, None):
+            with mock.patch.object(recommendations, 'np', np), self.settings(RECOMMENDATIONS_TOP_K=2):
+                self.assertEqual(build_recommendations(), (4, 3))
+            stored = Recommendation.objects.get(id=self.lamp.id)
+            self.assertEqual((stored.related, stored.scores), ([self.chair.id, self.desk.id], [2.0, 2.0]))
+            # Cancelled orders do not count, the rug only gets the newest products of its category
+            stored = Recommendation.objects.get(id=self.rug.id)
+            self.assertEqual((stored.related, stored.scores), ([self.chair.id, self.desk.id], [0.0, 0.0]))
+
+    def test_related_products_falls_back_to_the_category(self):
+        self.create_product('Old Sofa', is_active=False)
+        self.assertEqual(self.related(self.rug), ['Chair', 'Desk', 'Lamp'])
+
+        build_recommendations()
+        self.rug.is_active = False
+        self.rug.save()
+        self.assertEqual(self.related(self.lamp), ['Chair', 'Desk'])
@@ -7,9 +7,13 @@ urlpatterns = [
     path('products/', views.product_list, name='product_list'),
     path('products/<str:category_slug>/', views.product_list, name='product_list_by_category'),
     path('product/<str:product_slug>/', views.product_detail, name='product_detail'),
+    path('search/', views.search, name='search'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
+    path('metrics', views.metrics, name='metrics'),
     
     # Cart functionality
     path('cart/', views.cart, name='cart'),
+    path('cart/summary/', views.cart_summary, name='cart_summary'),
     path('add-to-cart/', views.add_to_cart, name='add_to_cart'),
     path('update-cart/', views.update_cart, name='update_cart'),
     path('remove-from-cart/', views.remove_from_cart, name='remove_from_cart'),
@@ -26,6 +30,7 @@ urlpatterns = [
     
     # Admin dashboard
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('dashboard/analytics/', views.sales_analytics, name='sales_analytics'),
     
     # Admin Product CRUD
     path('manage/products/', views.product_list_admin, name='product_list_admin'),
@@ -2,57 +2,91 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.urls import reverse
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.models import User
 from .models import Product, Category, Slide, CartItem, Customer, Order
+from .orders import place_order, OutOfStock
+from .cache import anonymous_page_cache, add_cache_tags, cart_changed, cart_version
+from .catalog import unique_slug
+from .images import schedule_variants
+from .media import store_upload, release_file
+from .pagination import paginate_by_cursor
+from .queries import (
+    select_related, cart_lines, summarize_cart, product_rows,
+    PRODUCT_CARD_FIELDS, PRODUCT_ADMIN_FIELDS, LOW_STOCK_FIELDS,
+)
+from .search import search_products
+from .suggest import suggest
+from .navigation import get_category
+from .recommendations import related_products as recommended_products
+from .stats import get_stats
+from . import metrics as store_metrics
+from .analytics import sales_report
 from django.utils import timezone
+from mongoengine.errors import NotUniqueError, ValidationError
+import hashlib
 import json
-import os
-import uuid
-from django.conf import settings
 
+@anonymous_page_cache
 def home(request):
     """Home page with carousel and featured products"""
-    slides = Slide.objects.filter(is_active=True).order_by('order')
-    featured_products = Product.objects.filter(is_active=True)[:8]
-    categories = Category.objects.all()
+    add_cache_tags(request, 'slides', 'catalog', 'categories')
+    # Lists, so the template's {% if %} checks don't issue queries of their own
+    slides = list(Slide.objects.filter(is_active=True).order_by('order'))
+    featured_products = product_rows(Product.objects.filter(is_active=True).limit(8), PRODUCT_CARD_FIELDS)
     
+    # Categories come from the cached navigation (nav_categories context processor)
     context = {
         'slides': slides,
         'featured_products': featured_products,
-        'categories': categories,
     }
     return render(request, 'ecommerce/home.html', context)
 
+@anonymous_page_cache
 def product_list(request, category_slug=None):
     """Product listing page with category filtering"""
-    categories = Category.objects.all()
+    add_cache_tags(request, 'catalog', 'categories')
     products = Product.objects.filter(is_active=True)
     
     if category_slug:
-        try:
-            category = Category.objects.get(slug=category_slug)
-            products = products.filter(category=category)
-        except Category.DoesNotExist:
+        category = get_category(category_slug)
+        if category is None:
             from django.http import Http404
             raise Http404("Category not found")
+        products = products.filter(category=category['id'])
+    
+    page = paginate_by_cursor(
+        products,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        load=lambda queryset: product_rows(queryset, PRODUCT_CARD_FIELDS),
+    )
     
     context = {
-        'products': products,
-        'categories': categories,
+        'products': page,
+        'page': page,
         'current_category': category_slug,
     }
     return render(request, 'ecommerce/product_list.html', context)
 
+@anonymous_page_cache
 def product_detail(request, product_slug):
     """Product detail page"""
+    # Tagged by slug before the read, the id is only known afterwards
+    add_cache_tags(request, f'product-slug:{product_slug}', 'recommendations')
     try:
         product = Product.objects.get(slug=product_slug, is_active=True)
-        related_products = Product.objects.filter(category=product.category, is_active=True).exclude(id=product.id)[:4]
     except Product.DoesNotExist:
         from django.http import Http404
         raise Http404("Product not found")
+    add_cache_tags(request, f'product:{product.id}', f'category:{product.category.id}')
+    related_products = recommended_products(product)
+    # Their names, prices and images are on the page too
+    add_cache_tags(request, *[f'product:{related.id}' for related in related_products])
     
     context = {
         'product': product,
@@ -60,13 +94,64 @@ def product_detail(request, product_slug):
     }
     return render(request, 'ecommerce/product_detail.html', context)
 
+@anonymous_page_cache
+def search(request):
+    """Product search ranked by relevance"""
+    add_cache_tags(request, 'catalog')
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    products, has_next = [], False
+    if query:
+        products, has_next = search_products(query, page)
+        select_related(products, 'category')
+
+    context = {
+        'query': query,
+        'products': products,
+        'page_number': page,
+        'has_previous': page > 1,
+        'has_next': has_next,
+        'previous_page': page - 1,
+        'next_page': page + 1,
+    }
+    return render(request, 'ecommerce/search.html', context)
+
+def search_suggest(request):
+    """Type-ahead product and category names for a prefix as JSON"""
+    query = request.GET.get('q', '').strip()
+    found = suggest(query, settings.SUGGEST_LIMIT) if query else {'products': [], 'categories': []}
+    
+    response = JsonResponse({
+        'query': query,
+        'products': [
+            {'name': name, 'url': reverse('product_detail', args=[slug])}
+            for name, slug in found['products'] if slug
+        ],
+        'categories': [
+            {'name': name, 'url': reverse('product_list_by_category', args=[slug])}
+            for name, slug in found['categories'] if slug
+        ],
+    })
+    patch_cache_control(response, public=True, max_age=60)
+    return response
+
+def metrics(request):
+    """Prometheus metrics summed over every worker process"""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    body = store_metrics.render(store_metrics.collect(settings.METRICS_DIR))
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def cart(request):
     """Cart page"""
     if not request.session.session_key:
         request.session.create()
     
-    cart_items = CartItem.objects.filter(session_key=request.session.session_key)
-    total = sum(item.product.price * item.quantity for item in cart_items)
+    cart_items, total = cart_lines(request.session.session_key)
     
     context = {
         'cart_items': cart_items,
@@ -74,6 +159,27 @@ def cart(request):
     }
     return render(request, 'ecommerce/cart.html', context)
 
+def cart_summary(request):
+    """Lightweight cart badge data (item count and total) as JSON"""
+    session_key = request.session.session_key
+    item_count, total = 0, 0
+    etag = None
+    if session_key:
+        # The version is checked before the cart is read, an unchanged cart costs no query
+        etag = '"%s"' % cart_version(session_key)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            patch_cache_control(not_modified, private=True, no_cache=True)
+            return not_modified
+        item_count, total = summarize_cart(session_key)
+    
+    data = {'item_count': item_count, 'total': round(total, 2)}
+    response = JsonResponse(data)
+    response['ETag'] = etag or '"%s"' % hashlib.md5(response.content).hexdigest()
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(request, etag=response['ETag'], response=response)
+
 @csrf_exempt
 def add_to_cart(request):
     """Add product to cart"""
@@ -82,37 +188,48 @@ def add_to_cart(request):
         product_id = data.get('product_id')
         quantity = int(data.get('quantity', 1))
         
+        if quantity < 1:
+            return JsonResponse({'success': False, 'message': 'Invalid quantity'})
+        
         if not request.session.session_key:
             request.session.create()
+        session_key = request.session.session_key
         
         try:
-            product = Product.objects.get(id=product_id, is_active=True)
-            
-            # Check if item already in cart
-            existing_cart_item = CartItem.objects.filter(
-                product=product,
-                session_key=request.session.session_key
-            ).first()
-            
-            if existing_cart_item:
-                existing_cart_item.quantity += quantity
-                existing_cart_item.save()
-                cart_item = existing_cart_item
-            else:
-                cart_item = CartItem.objects.create(
-                    product=product,
-                    session_key=request.session.session_key,
-                    quantity=quantity
-                )
-            
-            # Remove the old logic since we handle it above
-            
-            return JsonResponse({'success': True, 'message': 'Product added to cart'})
-        except Product.DoesNotExist:
+            # Projected existence check, no full product document is loaded
+            product_id = Product.objects.filter(id=product_id, is_active=True).scalar('id').first()
+        except ValidationError:
+            product_id = None
+        if not product_id:
             return JsonResponse({'success': False, 'message': 'Product not found'})
+        
+        # Single atomic upsert against the unique (session_key, product) index
+        try:
+            cart_item = increment_cart_item(session_key, product_id, quantity)
+        except NotUniqueError:
+            # A concurrent request inserted the line first, increment it instead
+            cart_item = increment_cart_item(session_key, product_id, quantity)
+        cart_changed(session_key)
+        
+        return JsonResponse({
+            'success': True,
+            'message': 'Product added to cart',
+            'item_id': str(cart_item.id),
+            'quantity': cart_item.quantity,
+            'cart_count': CartItem.objects.filter(session_key=session_key).count(),
+        })
     
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
+def increment_cart_item(session_key, product_id, quantity):
+    """Atomically add quantity to a cart line, creating it if needed"""
+    return CartItem.objects.filter(session_key=session_key, product=product_id).modify(
+        upsert=True,
+        new=True,
+        inc__quantity=quantity,
+        set_on_insert__created_at=timezone.now()
+    )
+
 @csrf_exempt
 def update_cart(request):
     """Update cart item quantity"""
@@ -120,18 +237,25 @@ def update_cart(request):
         data = json.loads(request.body)
         item_id = data.get('item_id')
         quantity = int(data.get('quantity', 1))
+        session_key = request.session.session_key
         
         try:
-            cart_item = CartItem.objects.get(id=item_id, session_key=request.session.session_key)
+            cart_items = CartItem.objects.filter(id=item_id, session_key=session_key)
             if quantity > 0:
-                cart_item.quantity = quantity
-                cart_item.save()
+                updated = cart_items.update_one(set__quantity=quantity)
             else:
-                cart_item.delete()
-            
-            return JsonResponse({'success': True})
-        except CartItem.DoesNotExist:
+                updated = cart_items.delete()
+        except ValidationError:
+            updated = 0
+        if not updated:
             return JsonResponse({'success': False, 'message': 'Cart item not found'})
+        cart_changed(session_key)
+        
+        return JsonResponse({
+            'success': True,
+            'quantity': max(quantity, 0),
+            'cart_count': CartItem.objects.filter(session_key=session_key).count(),
+        })
     
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
@@ -141,13 +265,20 @@ def remove_from_cart(request):
     if request.method == 'POST':
         data = json.loads(request.body)
         item_id = data.get('item_id')
+        session_key = request.session.session_key
         
         try:
-            cart_item = CartItem.objects.get(id=item_id, session_key=request.session.session_key)
-            cart_item.delete()
-            return JsonResponse({'success': True})
-        except CartItem.DoesNotExist:
+            deleted = CartItem.objects.filter(id=item_id, session_key=session_key).delete()
+        except ValidationError:
+            deleted = 0
+        if not deleted:
             return JsonResponse({'success': False, 'message': 'Cart item not found'})
+        cart_changed(session_key)
+        
+        return JsonResponse({
+            'success': True,
+            'cart_count': CartItem.objects.filter(session_key=session_key).count(),
+        })
     
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
@@ -208,13 +339,11 @@ def checkout(request):
     if not request.session.session_key:
         return redirect('cart')
     
-    cart_items = CartItem.objects.filter(session_key=request.session.session_key)
-    if not cart_items.exists():
+    cart_items, total = cart_lines(request.session.session_key)
+    if not cart_items:
         messages.error(request, 'Your cart is empty')
         return redirect('cart')
     
-    total = sum(item.product.price * item.quantity for item in cart_items)
-    
     if request.method == 'POST':
         shipping_address = request.POST.get('shipping_address')
         
@@ -228,15 +357,18 @@ def checkout(request):
             customer = existing_customer
         else:
             customer = Customer.objects.create(user_id=request.user.id)
-        order = Order.objects.create(
-            customer_id=str(customer.id),
-            items=cart_items,
-            total_amount=total,
-            shipping_address=shipping_address
-        )
-        
-        # Clear cart
-        cart_items.delete()
+        try:
+            # Reserves stock, creates the order and removes the ordered lines from the cart
+            order = place_order(
+                customer_id=str(customer.id),
+                session_key=request.session.session_key,
+                cart_items=cart_items,
+                total=total,
+                shipping_address=shipping_address
+            )
+        except OutOfStock as e:
+            messages.error(request, str(e))
+            return redirect('cart')
         
         messages.success(request, f'Order placed successfully! Order number: {order.order_number}')
         return redirect('order_confirmation', order_id=order.id)
@@ -268,7 +400,7 @@ def my_orders(request):
         customer = Customer.objects.create(user_id=request.user.id)
     
     # Convert customer.id to string for proper comparison
-    orders = Order.objects.filter(customer_id=str(customer.id)).order_by('-created_at')
+    orders = list(Order.objects.filter(customer_id=str(customer.id)).order_by('-created_at'))
     return render(request, 'ecommerce/my_orders.html', {'orders': orders})
 
 @login_required
@@ -279,28 +411,39 @@ def dashboard(request):
         messages.error(request, 'Access denied. Admin privileges required.')
         return redirect('home')
     
-    # Get statistics
-    total_products = Product.objects.count()
-    total_categories = Category.objects.count()
-    total_orders = Order.objects.count()
-    total_customers = Customer.objects.count()
+    # Get statistics (materialized, see ecommerce.stats)
+    stats = get_stats()
     
     # Get recent orders
-    recent_orders = Order.objects.order_by('-created_at')[:5]
+    recent_orders = list(Order.objects.order_by('-created_at')[:5])
     
     # Get low stock products
-    low_stock_products = Product.objects.filter(stock__lt=10, is_active=True)[:5]
+    low_stock_products = product_rows(Product.objects.filter(id__in=stats.low_stock[:5]), LOW_STOCK_FIELDS)
     
     context = {
-        'total_products': total_products,
-        'total_categories': total_categories,
-        'total_orders': total_orders,
-        'total_customers': total_customers,
+        'total_products': stats.products,
+        'total_categories': stats.categories,
+        'total_orders': stats.orders,
+        'total_customers': stats.customers,
         'recent_orders': recent_orders,
         'low_stock_products': low_stock_products,
     }
     return render(request, 'ecommerce/dashboard.html', context)
 
+@login_required
+def sales_analytics(request):
+    """Sales report read from the pre-aggregated rollups"""
+    if not request.user.is_staff:
+        messages.error(request, 'Access denied. Admin privileges required.')
+        return redirect('home')
+    
+    try:
+        days = min(max(int(request.GET.get('days', 30)), 1), 366)
+    except ValueError:
+        days = 30
+    
+    return render(request, 'ecommerce/analytics.html', {'report': sales_report(days)})
+
 # ==================== PRODUCT CRUD OPERATIONS ====================
 
 @login_required
@@ -310,7 +453,7 @@ def product_list_admin(request):
         messages.error(request, 'Access denied. Admin privileges required.')
         return redirect('home')
     
-    products = Product.objects.all().order_by('-created_at')
+    products = product_rows(Product.objects.order_by('-created_at'), PRODUCT_ADMIN_FIELDS)
     return render(request, 'ecommerce/admin/product_list.html', {'products': products})
 
 @login_required
@@ -340,34 +483,26 @@ def product_create(request):
             if request.FILES:
                 for uploaded_file in request.FILES.getlist('image_files'):
                     if uploaded_file:
-                        # Create media directory if it doesn't exist
-                        media_dir = os.path.join(settings.MEDIA_ROOT, 'products')
-                        os.makedirs(media_dir, exist_ok=True)
-                        
-                        # Generate unique filename
-                        file_extension = os.path.splitext(uploaded_file.name)[1]
-                        filename = f"product_{uuid.uuid4().hex}{file_extension}"
-                        file_path = os.path.join(media_dir, filename)
-                        
-                        # Save file
-                        with open(file_path, 'wb+') as destination:
-                            for chunk in uploaded_file.chunks():
-                                destination.write(chunk)
-                        
-                        # Store relative path for database
-                        relative_path = os.path.join('media', 'products', filename)
-                        image_files.append(relative_path)
+                        image_files.append(store_upload(uploaded_file, 'products'))
             
-            product = Product.objects.create(
-                name=name,
-                description=description,
-                price=float(price),
-                stock=int(stock),
-                category=category,
-                image_urls=image_urls,
-                image_files=image_files,
-                is_active=is_active
-            )
+            try:
+                product = Product.objects.create(
+                    name=name,
+                    description=description,
+                    price=float(price),
+                    stock=int(stock),
+                    category=category,
+                    image_urls=image_urls,
+                    image_files=image_files,
+                    is_active=is_active,
+                    slug=unique_slug(Product, name)
+                )
+            except Exception:
+                # Give back the references taken by the uploads
+                for image_path in image_files:
+                    release_file(image_path)
+                raise
+            schedule_variants(product, image_files, 'products')
             messages.success(request, f'Product "{product.name}" created successfully!')
             return redirect('product_list_admin')
         except Exception as e:
@@ -406,26 +541,17 @@ def product_update(request, product_id):
             
             # Handle file uploads
             image_files = list(product.image_files) if product.image_files else []  # Keep existing files
+            new_files = []
             if request.FILES:
                 for uploaded_file in request.FILES.getlist('image_files'):
                     if uploaded_file:
-                        # Create media directory if it doesn't exist
-                        media_dir = os.path.join(settings.MEDIA_ROOT, 'products')
-                        os.makedirs(media_dir, exist_ok=True)
-                        
-                        # Generate unique filename
-                        file_extension = os.path.splitext(uploaded_file.name)[1]
-                        filename = f"product_{uuid.uuid4().hex}{file_extension}"
-                        file_path = os.path.join(media_dir, filename)
-                        
-                        # Save file
-                        with open(file_path, 'wb+') as destination:
-                            for chunk in uploaded_file.chunks():
-                                destination.write(chunk)
-                        
-                        # Store relative path for database
-                        relative_path = os.path.join('media', 'products', filename)
+                        relative_path = store_upload(uploaded_file, 'products')
+                        if relative_path in image_files:
+                            # Same content as an image the product already has
+                            release_file(relative_path)
+                            continue
                         image_files.append(relative_path)
+                        new_files.append(relative_path)
             
             product.name = name
             product.description = description
@@ -435,7 +561,13 @@ def product_update(request, product_id):
             product.image_urls = image_urls
             product.image_files = image_files
             product.is_active = is_active
-            product.save()
+            try:
+                product.save()
+            except Exception:
+                for image_path in new_files:
+                    release_file(image_path)
+                raise
+            schedule_variants(product, new_files, 'products')
             
             messages.success(request, f'Product "{product.name}" updated successfully!')
             return redirect('product_list_admin')
@@ -500,31 +632,22 @@ def slide_create(request):
             if request.FILES and 'image_file' in request.FILES:
                 uploaded_file = request.FILES['image_file']
                 if uploaded_file:
-                    # Create media directory if it doesn't exist
-                    media_dir = os.path.join(settings.MEDIA_ROOT, 'slides')
-                    os.makedirs(media_dir, exist_ok=True)
-                    
-                    # Generate unique filename
-                    file_extension = os.path.splitext(uploaded_file.name)[1]
-                    filename = f"slide_{uuid.uuid4().hex}{file_extension}"
-                    file_path = os.path.join(media_dir, filename)
-                    
-                    # Save file
-                    with open(file_path, 'wb+') as destination:
-                        for chunk in uploaded_file.chunks():
-                            destination.write(chunk)
-                    
-                    # Store relative path for database
-                    image_file = os.path.join('media', 'slides', filename)
+                    image_file = store_upload(uploaded_file, 'slides')
             
-            slide = Slide.objects.create(
-                title=title,
-                subtitle=subtitle,
-                image_url=image_url if image_url else None,
-                image_file=image_file,
-                order=int(order),
-                is_active=is_active
-            )
+            try:
+                slide = Slide.objects.create(
+                    title=title,
+                    subtitle=subtitle,
+                    image_url=image_url if image_url else None,
+                    image_file=image_file,
+                    order=int(order),
+                    is_active=is_active
+                )
+            except Exception:
+                release_file(image_file)
+                raise
+            if image_file:
+                schedule_variants(slide, [image_file], 'slides')
             messages.success(request, f'Slide "{slide.title}" created successfully!')
             return redirect('slide_list_admin')
         except Exception as e:
@@ -558,30 +681,30 @@ def slide_update(request, slide_id):
             if request.FILES and 'image_file' in request.FILES:
                 uploaded_file = request.FILES['image_file']
                 if uploaded_file:
-                    # Create media directory if it doesn't exist
-                    media_dir = os.path.join(settings.MEDIA_ROOT, 'slides')
-                    os.makedirs(media_dir, exist_ok=True)
-                    
-                    # Generate unique filename
-                    file_extension = os.path.splitext(uploaded_file.name)[1]
-                    filename = f"slide_{uuid.uuid4().hex}{file_extension}"
-                    file_path = os.path.join(media_dir, filename)
-                    
-                    # Save file
-                    with open(file_path, 'wb+') as destination:
-                        for chunk in uploaded_file.chunks():
-                            destination.write(chunk)
-                    
-                    # Store relative path for database
-                    image_file = os.path.join('media', 'slides', filename)
+                    image_file = store_upload(uploaded_file, 'slides')
+                    if image_file == slide.image_file:
+                        # Same content as the current image: keep its one reference
+                        release_file(image_file)
             
             slide.title = title
             slide.subtitle = subtitle
             slide.image_url = image_url if image_url else None
+            previous_file = slide.image_file
+            replaced = image_file != previous_file
             slide.image_file = image_file
+            if replaced:
+                slide.image_variants = []
             slide.order = int(order)
             slide.is_active = is_active
-            slide.save()
+            try:
+                slide.save()
+            except Exception:
+                if replaced:
+                    release_file(image_file)
+                raise
+            if replaced:
+                release_file(previous_file)
+                schedule_variants(slide, [image_file], 'slides')
             
             messages.success(request, f'Slide "{slide.title}" updated successfully!')
             return redirect('slide_list_admin')